@@ -1,210 +1,283 @@
-from langchain_openai import ChatOpenAI
+import functools
+
 from langgraph.prebuilt import create_react_agent
 from langgraph_supervisor import create_supervisor
 
-# Import tools from separate files
-from .hr_database_tools import database_tools
-from .hr_policy_tools import policy_tools
-from .hr_performance_tools import performance_tools
-from .hr_training_tools import training_tools
-from .hr_analytics_tools import analytics_tools
-
-# Initialize Model
-model = ChatOpenAI(model="gpt-4o", temperature=0)
-
-# === HR Database Agent ===
-hr_database_agent = create_react_agent(
-    model=model,
-    tools=database_tools,
-    name="hr_database_agent",
-    prompt=(
-        "You are an HR Database Specialist with expertise in employee data management. "
-        "Your role is to help with queries about:\n"
-        "- Employee information and details\n"
-        "- Department listings and organizational structure\n"
-        "- Attendance records and patterns\n"
-        "- Database queries and data analysis\n\n"
-        "Guidelines:\n"
-        "- Always provide accurate, well-formatted responses\n"
-        "- Use markdown formatting for lists and tables\n"
-        "- Be helpful and professional\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- When presenting employee lists, use bullet points\n"
-        "- When showing detailed data, use tables when appropriate\n"
-    )
+from .llm_client import shared_llm
+
+# All agents and the supervisor share one client (and one connection pool).
+model = shared_llm
+
+# Display names used both on the agent objects and in the supervisor prompt.
+# Kept as constants so the prompt can be frozen at import time without
+# constructing the agents (whose tool modules are imported lazily below).
+HR_DATABASE_AGENT_DISPLAY_NAME = "HR Database Assistant"
+HR_POLICY_AGENT_DISPLAY_NAME = "HR Policy Assistant"
+HR_ATTENDANCE_AGENT_DISPLAY_NAME = "HR Attendance Assistant"
+HR_PERFORMANCE_AGENT_DISPLAY_NAME = "HR Performance Assistant"
+HR_TRAINING_AGENT_DISPLAY_NAME = "HR Training Assistant"
+HR_ANALYTICS_AGENT_DISPLAY_NAME = "HR Analytics Assistant"
+
+# === Agent prompts ===
+# Frozen once at import time. Provider-side prompt caches key on byte-exact
+# prefixes, so these strings must never be rebuilt or interpolated per call.
+HR_DATABASE_AGENT_PROMPT = (
+    "You are an HR Database Specialist with expertise in employee data management. "
+    "Your role is to help with queries about:\n"
+    "- Employee information and details\n"
+    "- Department listings and organizational structure\n"
+    "- Attendance records and patterns\n"
+    "- Database queries and data analysis\n\n"
+    "Guidelines:\n"
+    "- Always provide accurate, well-formatted responses\n"
+    "- Use markdown formatting for lists and tables\n"
+    "- Be helpful and professional\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- When presenting employee lists, use bullet points\n"
+    "- When showing detailed data, use tables when appropriate\n"
 )
-hr_database_agent.display_name = "HR Database Assistant"
-
-# === HR Policy Agent ===
-hr_policy_agent = create_react_agent(
-    model=model,
-    tools=policy_tools,
-    name="hr_policy_agent", 
-    prompt=(
-        "You are an HR Policy Specialist with expertise in company policies and leave management. "
-        "Your role is to help with:\n"
-        "- HR policy questions and clarifications\n"
-        "- Leave request submissions and management\n"
-        "- Leave balance inquiries\n"
-        "- Company holidays and important dates\n"
-        "- Benefits and procedures\n\n"
-        "Guidelines:\n"
-        "- Always be helpful and professional\n"
-        "- Provide clear, actionable information\n"
-        "- When submitting leave requests, confirm all details\n"
-        "- Use appropriate emojis to make responses friendly\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- For policy questions, provide relevant excerpts and summaries\n"
-    )
+
+HR_POLICY_AGENT_PROMPT = (
+    "You are an HR Policy Specialist with expertise in company policies and leave management. "
+    "Your role is to help with:\n"
+    "- HR policy questions and clarifications\n"
+    "- Leave request submissions and management\n"
+    "- Leave balance inquiries\n"
+    "- Company holidays and important dates\n"
+    "- Benefits and procedures\n\n"
+    "Guidelines:\n"
+    "- Always be helpful and professional\n"
+    "- Provide clear, actionable information\n"
+    "- When submitting leave requests, confirm all details\n"
+    "- Use appropriate emojis to make responses friendly\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- For policy questions, provide relevant excerpts and summaries\n"
 )
-hr_policy_agent.display_name = "HR Policy Assistant"
-
-# === HR Attendance Agent ===
-# This agent specializes in attendance-related queries
-hr_attendance_agent = create_react_agent(
-    model=model,
-    tools=database_tools,  # Uses database tools but with specialized focus
-    name="hr_attendance_agent",
-    prompt=(
-        "You are an HR Attendance Specialist focused on attendance tracking and analysis. "
-        "Your expertise includes:\n"
-        "- Daily attendance records\n"
-        "- Attendance patterns and trends\n"
-        "- Absenteeism analysis\n"
-        "- Work schedule inquiries\n\n"
-        "Guidelines:\n"
-        "- Focus specifically on attendance-related aspects of database queries\n"
-        "- Provide insights about attendance patterns when relevant\n"
-        "- Be detail-oriented with dates and attendance status\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- When showing attendance data, organize by date or employee as appropriate\n"
-    )
+
+HR_ATTENDANCE_AGENT_PROMPT = (
+    "You are an HR Attendance Specialist focused on attendance tracking and analysis. "
+    "Your expertise includes:\n"
+    "- Daily attendance records\n"
+    "- Attendance patterns and trends\n"
+    "- Absenteeism analysis\n"
+    "- Work schedule inquiries\n\n"
+    "Guidelines:\n"
+    "- Focus specifically on attendance-related aspects of database queries\n"
+    "- Provide insights about attendance patterns when relevant\n"
+    "- Be detail-oriented with dates and attendance status\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- When showing attendance data, organize by date or employee as appropriate\n"
 )
-hr_attendance_agent.display_name = "HR Attendance Assistant"
-
-# === HR Performance Management Agent ===
-hr_performance_agent = create_react_agent(
-    model=model,
-    tools=performance_tools,
-    name="hr_performance_agent",
-    prompt=(
-        "You are an HR Performance Management Specialist with expertise in employee performance tracking and development. "
-        "Your role includes:\n"
-        "- Creating and tracking performance goals\n"
-        "- Scheduling and managing performance reviews\n"
-        "- Collecting 360-degree feedback\n"
-        "- Generating performance summaries and reports\n"
-        "- Analyzing team performance metrics\n\n"
-        "Guidelines:\n"
-        "- Focus on constructive performance improvement\n"
-        "- Provide actionable insights and recommendations\n"
-        "- Be supportive and professional in all interactions\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- When creating goals, ensure they are SMART (Specific, Measurable, Achievable, Relevant, Time-bound)\n"
-    )
+
+HR_PERFORMANCE_AGENT_PROMPT = (
+    "You are an HR Performance Management Specialist with expertise in employee performance tracking and development. "
+    "Your role includes:\n"
+    "- Creating and tracking performance goals\n"
+    "- Scheduling and managing performance reviews\n"
+    "- Collecting 360-degree feedback\n"
+    "- Generating performance summaries and reports\n"
+    "- Analyzing team performance metrics\n\n"
+    "Guidelines:\n"
+    "- Focus on constructive performance improvement\n"
+    "- Provide actionable insights and recommendations\n"
+    "- Be supportive and professional in all interactions\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- When creating goals, ensure they are SMART (Specific, Measurable, Achievable, Relevant, Time-bound)\n"
 )
-hr_performance_agent.display_name = "HR Performance Assistant"
-
-# === HR Training & Development Agent ===
-hr_training_agent = create_react_agent(
-    model=model,
-    tools=training_tools,
-    name="hr_training_agent",
-    prompt=(
-        "You are an HR Learning & Development Specialist focused on employee growth and skill development. "
-        "Your expertise includes:\n"
-        "- Skill gap analysis and assessment\n"
-        "- Training program recommendations\n"
-        "- Learning path creation and management\n"
-        "- Training completion tracking\n"
-        "- Skills assessment scheduling\n\n"
-        "Guidelines:\n"
-        "- Focus on continuous learning and development\n"
-        "- Provide personalized learning recommendations\n"
-        "- Be encouraging and supportive of employee growth\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- When recommending training, consider employee's current role and career aspirations\n"
-    )
+
+HR_TRAINING_AGENT_PROMPT = (
+    "You are an HR Learning & Development Specialist focused on employee growth and skill development. "
+    "Your expertise includes:\n"
+    "- Skill gap analysis and assessment\n"
+    "- Training program recommendations\n"
+    "- Learning path creation and management\n"
+    "- Training completion tracking\n"
+    "- Skills assessment scheduling\n\n"
+    "Guidelines:\n"
+    "- Focus on continuous learning and development\n"
+    "- Provide personalized learning recommendations\n"
+    "- Be encouraging and supportive of employee growth\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- When recommending training, consider employee's current role and career aspirations\n"
 )
-hr_training_agent.display_name = "HR Training Assistant"
-
-# === HR Analytics & Reporting Agent ===
-hr_analytics_agent = create_react_agent(
-    model=model,
-    tools=analytics_tools,
-    name="hr_analytics_agent",
-    prompt=(
-        "You are an HR Analytics & Reporting Specialist with expertise in data analysis and insights generation. "
-        "Your role includes:\n"
-        "- Generating HR dashboard metrics and KPIs\n"
-        "- Analyzing attendance patterns and trends\n"
-        "- Predicting employee turnover risks\n"
-        "- Creating compliance and custom reports\n"
-        "- Tracking organizational performance metrics\n\n"
-        "Guidelines:\n"
-        "- Provide data-driven insights and recommendations\n"
-        "- Use clear visualizations and explanations\n"
-        "- Focus on actionable business intelligence\n"
-        "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
-        "- When presenting data, include context and interpretation for business users\n"
+
+HR_ANALYTICS_AGENT_PROMPT = (
+    "You are an HR Analytics & Reporting Specialist with expertise in data analysis and insights generation. "
+    "Your role includes:\n"
+    "- Generating HR dashboard metrics and KPIs\n"
+    "- Analyzing attendance patterns and trends\n"
+    "- Predicting employee turnover risks\n"
+    "- Creating compliance and custom reports\n"
+    "- Tracking organizational performance metrics\n\n"
+    "Guidelines:\n"
+    "- Provide data-driven insights and recommendations\n"
+    "- Use clear visualizations and explanations\n"
+    "- Focus on actionable business intelligence\n"
+    "- Respond in Sinhala if the user asks in Sinhala, otherwise respond in English\n"
+    "- When presenting data, include context and interpretation for business users\n"
+)
+
+
+# === Agent factories ===
+# Tool modules pull in the DB engine, sqlparse, embeddings, etc., so they are
+# imported lazily inside these cached getters instead of at module top. Each
+# agent is built at most once per process, on first use.
+
+@functools.cache
+def get_hr_database_agent():
+    from .hr_database_tools import database_tools
+
+    agent = create_react_agent(
+        model=model,
+        tools=database_tools,
+        name="hr_database_agent",
+        prompt=HR_DATABASE_AGENT_PROMPT,
+    )
+    agent.display_name = HR_DATABASE_AGENT_DISPLAY_NAME
+    return agent
+
+
+@functools.cache
+def get_hr_policy_agent():
+    from .hr_policy_tools import policy_tools
+
+    agent = create_react_agent(
+        model=model,
+        tools=policy_tools,
+        name="hr_policy_agent",
+        prompt=HR_POLICY_AGENT_PROMPT,
+    )
+    agent.display_name = HR_POLICY_AGENT_DISPLAY_NAME
+    return agent
+
+
+@functools.cache
+def get_hr_attendance_agent():
+    from .hr_database_tools import database_tools
+
+    # Uses database tools but with specialized focus
+    agent = create_react_agent(
+        model=model,
+        tools=database_tools,
+        name="hr_attendance_agent",
+        prompt=HR_ATTENDANCE_AGENT_PROMPT,
+    )
+    agent.display_name = HR_ATTENDANCE_AGENT_DISPLAY_NAME
+    return agent
+
+
+@functools.cache
+def get_hr_performance_agent():
+    from .hr_performance_tools import performance_tools
+
+    agent = create_react_agent(
+        model=model,
+        tools=performance_tools,
+        name="hr_performance_agent",
+        prompt=HR_PERFORMANCE_AGENT_PROMPT,
+    )
+    agent.display_name = HR_PERFORMANCE_AGENT_DISPLAY_NAME
+    return agent
+
+
+@functools.cache
+def get_hr_training_agent():
+    from .hr_training_tools import training_tools
+
+    agent = create_react_agent(
+        model=model,
+        tools=training_tools,
+        name="hr_training_agent",
+        prompt=HR_TRAINING_AGENT_PROMPT,
     )
+    agent.display_name = HR_TRAINING_AGENT_DISPLAY_NAME
+    return agent
+
+
+@functools.cache
+def get_hr_analytics_agent():
+    from .hr_analytics_tools import analytics_tools
+
+    agent = create_react_agent(
+        model=model,
+        tools=analytics_tools,
+        name="hr_analytics_agent",
+        prompt=HR_ANALYTICS_AGENT_PROMPT,
+    )
+    agent.display_name = HR_ANALYTICS_AGENT_DISPLAY_NAME
+    return agent
+
+
+# Supervisor prompt: the display-name substitution happens exactly once here
+# at import, so the string passed to the provider is identical on every turn.
+SUPERVISOR_PROMPT = (
+    "You are an intelligent HR Assistant Supervisor managing a team of specialized HR agents. "
+    "Your team consists of:\n\n"
+    f"🔍 **{HR_DATABASE_AGENT_DISPLAY_NAME}**: Expert in employee data, departments, and general database queries\n"
+    "   - Use for: employee listings, department info, employee details, general HR data queries\n\n"
+    f"📋 **{HR_POLICY_AGENT_DISPLAY_NAME}**: Expert in HR policies, leave management, and benefits\n"
+    "   - Use for: policy questions, leave requests, leave balances, holidays, company procedures\n\n"
+    f"📊 **{HR_ATTENDANCE_AGENT_DISPLAY_NAME}**: Expert in attendance tracking and analysis\n"
+    "   - Use for: attendance records, who was present/absent, attendance patterns, daily reports\n\n"
+    f"🎯 **{HR_PERFORMANCE_AGENT_DISPLAY_NAME}**: Expert in performance management and employee development\n"
+    "   - Use for: performance goals, reviews, 360 feedback, performance summaries, team performance\n\n"
+    f"📚 **{HR_TRAINING_AGENT_DISPLAY_NAME}**: Expert in learning & development and skill management\n"
+    "   - Use for: skill assessments, training recommendations, learning paths, training tracking\n\n"
+    f"📈 **{HR_ANALYTICS_AGENT_DISPLAY_NAME}**: Expert in HR analytics, reporting, and data insights\n"
+    "   - Use for: HR metrics, KPIs, compliance reports, custom reports, turnover analysis, trends\n\n"
+    "**Decision Guidelines:**\n"
+    "- For employee info, departments, general data → delegate to hr_database_agent\n"
+    "- For policy questions, leave requests, benefits → delegate to hr_policy_agent\n"
+    "- For attendance tracking, daily reports → delegate to hr_attendance_agent\n"
+    "- For performance goals, reviews, feedback → delegate to hr_performance_agent\n"
+    "- For training, skills, learning → delegate to hr_training_agent\n"
+    "- For reports, analytics, KPIs → delegate to hr_analytics_agent\n\n"
+    "Always choose the most appropriate specialized agent based on the user's specific request. "
+    "For compound requests that span independent areas (e.g. attendance AND analytics), "
+    "delegate to all relevant agents in the same turn so they can run in parallel. "
+    "Provide clear, helpful responses and maintain a professional yet friendly tone."
 )
-hr_analytics_agent.display_name = "HR Analytics Assistant"
 
 
 # === Create Supervisor System ===
+@functools.lru_cache(maxsize=1)
 def create_hr_supervisor_system():
     """
-    Creates and returns the compiled HR multi-agent supervisor system. 
-    
+    Creates and returns the compiled HR multi-agent supervisor system.
+
     The supervisor manages six specialized agents:
     1. HR Database Agent - Employee data and general database queries
-    2. HR Policy Agent - Policies, leave requests, and benefits  
+    2. HR Policy Agent - Policies, leave requests, and benefits
     3. HR Attendance Agent - Attendance tracking and analysis
     4. HR Performance Agent - Performance management and employee development
     5. HR Training Agent - Learning & development and skill management
     6. HR Analytics Agent - HR analytics, reporting, and data insights
+
+    Built lazily on first call (and cached), so importing this module stays
+    cheap; cold starts only pay for the agents once a request needs them.
     """
-    
+
     supervisor_workflow = create_supervisor(
         agents=[
-            hr_database_agent, 
-            hr_policy_agent, 
-            hr_attendance_agent, 
-            hr_performance_agent, 
-            hr_training_agent, 
-            hr_analytics_agent
+            get_hr_database_agent(),
+            get_hr_policy_agent(),
+            get_hr_attendance_agent(),
+            get_hr_performance_agent(),
+            get_hr_training_agent(),
+            get_hr_analytics_agent(),
         ],
         model=model,
-        prompt=(
-            "You are an intelligent HR Assistant Supervisor managing a team of specialized HR agents. "
-            "Your team consists of:\n\n"
-            f"🔍 **{hr_database_agent.display_name}**: Expert in employee data, departments, and general database queries\n"
-            "   - Use for: employee listings, department info, employee details, general HR data queries\n\n"
-            f"📋 **{hr_policy_agent.display_name}**: Expert in HR policies, leave management, and benefits\n"
-            "   - Use for: policy questions, leave requests, leave balances, holidays, company procedures\n\n"
-            f"📊 **{hr_attendance_agent.display_name}**: Expert in attendance tracking and analysis\n"
-            "   - Use for: attendance records, who was present/absent, attendance patterns, daily reports\n\n"
-            f"🎯 **{hr_performance_agent.display_name}**: Expert in performance management and employee development\n"
-            "   - Use for: performance goals, reviews, 360 feedback, performance summaries, team performance\n\n"
-            f"📚 **{hr_training_agent.display_name}**: Expert in learning & development and skill management\n"
-            "   - Use for: skill assessments, training recommendations, learning paths, training tracking\n\n"
-            f"📈 **{hr_analytics_agent.display_name}**: Expert in HR analytics, reporting, and data insights\n"
-            "   - Use for: HR metrics, KPIs, compliance reports, custom reports, turnover analysis, trends\n\n"
-            "**Decision Guidelines:**\n"
-            "- For employee info, departments, general data → delegate to hr_database_agent\n"
-            "- For policy questions, leave requests, benefits → delegate to hr_policy_agent\n"
-            "- For attendance tracking, daily reports → delegate to hr_attendance_agent\n"
-            "- For performance goals, reviews, feedback → delegate to hr_performance_agent\n"
-            "- For training, skills, learning → delegate to hr_training_agent\n"
-            "- For reports, analytics, KPIs → delegate to hr_analytics_agent\n\n"
-            "Always choose the most appropriate specialized agent based on the user's specific request. "
-            "Provide clear, helpful responses and maintain a professional yet friendly tone."
-        )
+        prompt=SUPERVISOR_PROMPT,
+        # Allow the supervisor to hand off to several agents in one turn;
+        # independent sub-agents then execute concurrently instead of
+        # serializing one handoff at a time.
+        parallel_tool_calls=True,
     )
-    
+
     # Compile the supervisor workflow to make it executable
     return supervisor_workflow.compile()
 
-# Create and compile the HR agent system
-hr_agent_system = create_hr_supervisor_system()
\ No newline at end of file
+
+def get_hr_agent_system():
+    """Return the (cached) compiled supervisor system."""
+    return create_hr_supervisor_system()
@@ -0,0 +1,26 @@
+import asyncio
+from typing import Any, Coroutine, Optional, Set
+
+# The event loop holds only weak references to tasks, so a bare
+# asyncio.create_task result can be garbage-collected mid-flight and any
+# failure vanishes as "Task exception was never retrieved". This set keeps
+# every fire-and-forget task alive until it finishes, and the done
+# callback surfaces its exception.
+_tasks: Set["asyncio.Task"] = set()
+
+
+def spawn(coro: Coroutine[Any, Any, Any], name: Optional[str] = None) -> "asyncio.Task":
+    """Schedule a fire-and-forget coroutine, keeping a reference to it."""
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_finalize)
+    return task
+
+
+def _finalize(task: "asyncio.Task") -> None:
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        print(f"--- Background task {task.get_name()!r} failed: {exc} ---")
@@ -8,7 +8,34 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Pin the psycopg (v3) driver regardless of how the env URL spells the
+# scheme, so server-side prepared statements below apply everywhere the
+# URL is reused (the PGVector store builds its own engine from it).
+if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
+    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+elif DATABASE_URL and DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
+
+# Explicit pool sizing: every agent tool opens a short-lived session, so
+# keeping warm connections around avoids paying the connect handshake per
+# tool call. pre_ping drops stale connections; recycle stays under typical
+# server-side idle timeouts. prepare_threshold makes psycopg promote any
+# statement run five times on a connection (the employee-by-name lookup,
+# chiefly) to a named server-side prepared statement, skipping the
+# parse/plan step on later executions.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=10,
+    max_overflow=20,
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+    # LIFO checkout keeps a small working set of connections hot (and
+    # their server-side prepared statements warm) while overflow
+    # connections idle out, instead of FIFO rotating through the pool.
+    pool_use_lifo=True,
+    connect_args={"connect_timeout": 5, "prepare_threshold": 5},
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
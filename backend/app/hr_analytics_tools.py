@@ -1,14 +1,218 @@
+import functools
 import os
+import time
 from datetime import datetime, date, timedelta
 from langchain.tools import tool
-from langchain_openai import ChatOpenAI
 from sqlalchemy import text, func
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import json
 
 from .database import SessionLocal, engine
+from .llm_client import get_chat_model
 from . import models
 
+# Shared report-generation client; constructing ChatOpenAI per call pays for
+# env parsing and a fresh httpx pool on every report.
+_AI_MODEL = get_chat_model(temperature=0.1)
+
+# Dashboard responses are identical for the same (period, day) within a short
+# window, and dashboards get hammered with refreshes. Cache the rendered
+# report for a few minutes; keying on today's date makes stale entries
+# self-expire at midnight even before the TTL does.
+_DASHBOARD_CACHE_TTL = 300  # seconds
+_dashboard_cache: Dict[Tuple[str, date], Tuple[float, str]] = {}
+
+DAY_PATTERNS = {0: 'Mon', 1: 'Tue', 2: 'Wed', 3: 'Thu', 4: 'Fri', 5: 'Sat', 6: 'Sun'}
+
+# KPI status markers, kept as data so report lines share one threshold table
+# instead of repeating nested ternaries per f-string.
+ATTENDANCE_TIERS = ((85, '✅'), (75, '⚠️'))
+EFFICIENCY_TIERS = ((90, '✅'), (75, '⚠️'))
+ABSENCE_TIERS = ((5, '✅'), (10, '⚠️'))
+BACKLOG_TIERS = ((5, '✅'),)
+
+
+def _tier(value, thresholds, default='❌'):
+    """Marker for the first threshold the value meets (higher is better)."""
+    for threshold, marker in thresholds:
+        if value >= threshold:
+            return marker
+    return default
+
+
+def _tier_low(value, thresholds, default='❌'):
+    """Marker for the first threshold the value stays under (lower is better)."""
+    for threshold, marker in thresholds:
+        if value <= threshold:
+            return marker
+    return default
+
+# Static SQL compiled to text() once at import; rebuilding these per call
+# re-runs SQLAlchemy's bind-parameter parsing for no benefit.
+DASHBOARD_SUMMARY_SQL = text("""
+    WITH emp AS (
+        SELECT
+            COUNT(*) FILTER (WHERE is_active) as total_employees,
+            (SELECT COUNT(*) FROM departments) as total_departments
+        FROM employees
+    ),
+    att AS (
+        SELECT
+            COUNT(*) as total_records,
+            COUNT(*) FILTER (WHERE status = 'Present') as present_count,
+            COUNT(*) FILTER (WHERE status LIKE '%Leave%') as leave_count,
+            COUNT(*) FILTER (WHERE status = 'Absent') as absent_count
+        FROM attendances
+        WHERE attendance_date BETWEEN :start_date AND :end_date
+    ),
+    lr AS (
+        SELECT
+            COUNT(*) as leave_requests,
+            COUNT(*) FILTER (WHERE status = 'pending') as pending_leaves
+        FROM leave_requests
+        WHERE leave_date BETWEEN :start_date AND :end_date
+    )
+    SELECT emp.*, att.*, lr.* FROM emp CROSS JOIN att CROSS JOIN lr
+""")
+
+DEPT_BREAKDOWN_SQL = text("""
+    SELECT
+        d.name,
+        COUNT(e.id) as employee_count,
+        AVG(CASE WHEN a.status = 'Present' THEN 1.0 ELSE 0.0 END) * 100 as dept_attendance_rate
+    FROM departments d
+    LEFT JOIN employees e ON d.id = e.department_id AND e.is_active = true
+    LEFT JOIN attendances a ON e.id = a.employee_id
+        AND a.attendance_date BETWEEN :start_date AND :end_date
+    GROUP BY d.id, d.name
+    ORDER BY employee_count DESC
+    LIMIT 5
+""")
+
+# Shared scoring CTE for the turnover queries: aggregate per-employee
+# counters, then sum threshold CASEs into a risk score — all in Postgres.
+_TURNOVER_SCORED_CTE = """
+    WITH stats AS (
+        SELECT
+            e.id,
+            e.name,
+            e.role,
+            d.name as department_name,
+            e.is_active,
+            COUNT(DISTINCT a.attendance_date) as total_attendance_days,
+            COUNT(DISTINCT a.attendance_date) FILTER (WHERE a.status = 'Present') as present_days,
+            COUNT(DISTINCT a.attendance_date) FILTER (WHERE a.status = 'Absent') as absent_days,
+            COUNT(DISTINCT lr.id) as leave_requests,
+            COUNT(DISTINCT lr.id) FILTER (WHERE lr.status = 'pending') as pending_leaves
+        FROM employees e
+        LEFT JOIN departments d ON e.department_id = d.id
+        LEFT JOIN attendances a ON e.id = a.employee_id
+            AND a.attendance_date >= :analysis_start
+        LEFT JOIN leave_requests lr ON e.id = lr.employee_id
+            AND lr.leave_date >= :analysis_start
+        WHERE e.is_active = true
+        GROUP BY e.id, e.name, e.role, d.name, e.is_active
+    ),
+    scored AS (
+        SELECT
+            stats.*,
+            (CASE WHEN present_days::float / NULLIF(total_attendance_days, 0) < 0.7 THEN 30
+                  WHEN present_days::float / NULLIF(total_attendance_days, 0) < 0.8 THEN 15
+                  ELSE 0 END
+             + CASE WHEN absent_days > 10 THEN 20 ELSE 0 END
+             + CASE WHEN leave_requests > 8 THEN 15 ELSE 0 END
+             + CASE WHEN pending_leaves > 3 THEN 10 ELSE 0 END
+             + CASE WHEN department_name IS NULL THEN 5 ELSE 0 END
+             + CASE WHEN role IS NULL OR role = '' THEN 5 ELSE 0 END
+            ) as risk_score
+        FROM stats
+    )
+"""
+
+# Only the ten rows that are actually rendered leave the database.
+TURNOVER_HIGH_RISK_SQL = text(_TURNOVER_SCORED_CTE + """
+    SELECT * FROM scored
+    WHERE risk_score >= 40
+    ORDER BY risk_score DESC, name
+    LIMIT 10
+""")
+
+# Bucket totals for the distribution section, one aggregate row.
+TURNOVER_DISTRIBUTION_SQL = text(_TURNOVER_SCORED_CTE + """
+    SELECT
+        COUNT(*) as total_count,
+        COUNT(*) FILTER (WHERE risk_score >= 40) as high_count,
+        COUNT(*) FILTER (WHERE risk_score BETWEEN 20 AND 39) as moderate_count,
+        COUNT(*) FILTER (WHERE risk_score < 20) as low_count
+    FROM scored
+""")
+
+# Per-employee counts come from a LATERAL subquery over the (employee_id,
+# attendance_date) index; the join condition drops employees with no records
+# in range up front instead of aggregating them and discarding via HAVING.
+# stream_results must be set before execution for the driver to use a
+# server-side cursor — a post-hoc .yield_per() on the result does not
+# stop the full result set being buffered client-side.
+ATTENDANCE_COMPLIANCE_SQL = text("""
+    SELECT
+        e.name,
+        d.name as department_name,
+        c.total_records,
+        c.present_count,
+        c.absent_count,
+        c.leave_count
+    FROM employees e
+    JOIN LATERAL (
+        SELECT
+            COUNT(*) as total_records,
+            COUNT(*) FILTER (WHERE a.status = 'Present') as present_count,
+            COUNT(*) FILTER (WHERE a.status = 'Absent') as absent_count,
+            COUNT(*) FILTER (WHERE a.status LIKE '%Leave%') as leave_count
+        FROM attendances a
+        WHERE a.employee_id = e.id
+          AND a.attendance_date BETWEEN :start_date AND :end_date
+    ) c ON c.total_records > 0
+    LEFT JOIN departments d ON e.department_id = d.id
+    WHERE e.is_active = true
+    ORDER BY e.name
+""").execution_options(stream_results=True, yield_per=500)
+
+# All KPI scalars come back in one row: the three aggregate CTEs are
+# independent one-row results, so CROSS JOIN-ing them costs nothing and
+# collapses four round trips into one.
+KPI_SUMMARY_SQL = text("""
+    WITH wf AS (
+        SELECT
+            COUNT(*) FILTER (WHERE is_active) as total_employees,
+            (SELECT COUNT(*) FROM departments) as total_departments
+        FROM employees
+    ),
+    att AS (
+        SELECT
+            COUNT(*) as total_records,
+            COUNT(*) FILTER (WHERE status = 'Present') as present_count,
+            COUNT(*) FILTER (WHERE status LIKE '%Leave%') as leave_count,
+            COUNT(*) FILTER (WHERE status = 'Absent') as absent_count
+        FROM attendances
+        WHERE attendance_date >= :month_start
+    ),
+    eng AS (
+        SELECT
+            COUNT(*) as total_requests,
+            COUNT(*) FILTER (WHERE status = 'pending') as pending_requests,
+            AVG((CURRENT_DATE - leave_date)) as avg_request_lead_time
+        FROM leave_requests
+        WHERE leave_date >= :year_start
+    )
+    SELECT * FROM wf CROSS JOIN att CROSS JOIN eng
+""")
+
+
+def invalidate_dashboard_cache() -> None:
+    """Drop cached dashboard reports (call after attendance/leave writes)."""
+    _dashboard_cache.clear()
+
+
 @tool
 def generate_hr_dashboard_metrics(period: str = "current_month") -> str:
     """
@@ -16,6 +220,18 @@ def generate_hr_dashboard_metrics(period: str = "current_month") -> str:
     Parameters:
     - period: Time period for metrics (current_month, current_quarter, current_year, last_month)
     """
+    cache_key = (period, datetime.now().date())
+    cached = _dashboard_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < _DASHBOARD_CACHE_TTL:
+        return cached[1]
+
+    report = _compute_dashboard_metrics(period)
+    if not report.startswith("An error occurred"):
+        _dashboard_cache[cache_key] = (time.monotonic(), report)
+    return report
+
+
+def _compute_dashboard_metrics(period: str) -> str:
     with SessionLocal() as db:
         try:
             current_date = datetime.now()
@@ -44,68 +260,46 @@ def generate_hr_dashboard_metrics(period: str = "current_month") -> str:
                 end_date = current_date.date()
                 period_label = current_date.strftime("%B %Y")
             
-            # Employee Metrics
-            total_employees = db.query(models.Employee).filter(models.Employee.is_active == True).count()
-            total_departments = db.query(models.Department).count()
-            
-            # Attendance Metrics
-            attendance_query = text("""
-                SELECT 
-                    COUNT(*) as total_records,
-                    COUNT(CASE WHEN status = 'Present' THEN 1 END) as present_count,
-                    COUNT(CASE WHEN status LIKE '%Leave%' THEN 1 END) as leave_count,
-                    COUNT(CASE WHEN status = 'Absent' THEN 1 END) as absent_count
-                FROM attendances 
-                WHERE attendance_date BETWEEN :start_date AND :end_date
-            """)
-            
-            attendance_result = db.execute(attendance_query, {
-                'start_date': start_date, 
+            # Workforce + Attendance + Leave Metrics
+            # Consolidated into one round-trip: each CTE produces a single
+            # aggregate row, joined into one result row instead of five
+            # separate queries over the same session.
+            summary_result = db.execute(DASHBOARD_SUMMARY_SQL, {
+                'start_date': start_date,
                 'end_date': end_date
-            }).fetchone()
-            
-            if attendance_result:
-                total_records, present_count, leave_count, absent_count = attendance_result
+            }).mappings().first()
+
+            if summary_result:
+                total_employees = summary_result['total_employees']
+                total_departments = summary_result['total_departments']
+                total_records = summary_result['total_records']
+                present_count = summary_result['present_count']
+                leave_count = summary_result['leave_count']
+                absent_count = summary_result['absent_count']
+                leave_requests = summary_result['leave_requests']
+                pending_leaves = summary_result['pending_leaves']
                 attendance_rate = (present_count / total_records * 100) if total_records > 0 else 0
                 leave_rate = (leave_count / total_records * 100) if total_records > 0 else 0
                 absent_rate = (absent_count / total_records * 100) if total_records > 0 else 0
             else:
+                total_employees = total_departments = 0
                 total_records = present_count = leave_count = absent_count = 0
+                leave_requests = pending_leaves = 0
                 attendance_rate = leave_rate = absent_rate = 0
-            
-            # Leave Requests Metrics
-            leave_requests = db.query(models.LeaveRequest).filter(
-                models.LeaveRequest.leave_date.between(start_date, end_date)
-            ).count()
-            
-            pending_leaves = db.query(models.LeaveRequest).filter(
-                models.LeaveRequest.leave_date.between(start_date, end_date),
-                models.LeaveRequest.status == 'pending'
-            ).count()
-            
+
             # Department Breakdown
-            dept_query = text("""
-                SELECT 
-                    d.name,
-                    COUNT(e.id) as employee_count,
-                    AVG(CASE WHEN a.status = 'Present' THEN 1.0 ELSE 0.0 END) * 100 as dept_attendance_rate
-                FROM departments d
-                LEFT JOIN employees e ON d.id = e.department_id AND e.is_active = true
-                LEFT JOIN attendances a ON e.id = a.employee_id 
-                    AND a.attendance_date BETWEEN :start_date AND :end_date
-                GROUP BY d.id, d.name
-                ORDER BY employee_count DESC
-            """)
-            
-            dept_result = db.execute(dept_query, {
+            dept_result = db.execute(DEPT_BREAKDOWN_SQL, {
                 'start_date': start_date,
                 'end_date': end_date
-            }).fetchall()
+            }).mappings().all()
             
-            return f"""📊 **HR Analytics Dashboard**
+            # The header used to be returned directly, leaving the breakdown
+            # loop below unreachable. Collect everything in a parts list and
+            # join once so the full report is actually produced.
+            parts = [f"""📊 **HR Analytics Dashboard**
 
 **Period:** {period_label}
-**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}
+**Generated:** {current_date.strftime('%Y-%m-%d %H:%M')}
 
 **👥 WORKFORCE OVERVIEW**
 • Total Active Employees: {total_employees}
@@ -123,17 +317,15 @@ def generate_hr_dashboard_metrics(period: str = "current_month") -> str:
 • Pending Approvals: {pending_leaves}
 • Approval Rate: {((leave_requests - pending_leaves) / leave_requests * 100) if leave_requests > 0 else 0:.1f}%
 
-**🏢 DEPARTMENT BREAKDOWN**"""
-            
-            result = result if 'result' in locals() else ""
-            
-            for dept_name, emp_count, dept_attendance in dept_result[:5]:  # Top 5 departments
-                dept_attendance = dept_attendance or 0
-                result += f"\n• **{dept_name}**: {emp_count} employees | {dept_attendance:.1f}% attendance"
-            
-            result += f"\n\n**🎯 KEY INSIGHTS**\n• {'High' if attendance_rate >= 85 else 'Moderate' if attendance_rate >= 75 else 'Low'} attendance rate overall\n• {'Efficient' if pending_leaves <= 5 else 'Review needed'} leave approval process\n• {'Well-distributed' if total_departments >= 3 else 'Centralized'} workforce structure\n\n**📊 TRENDING METRICS**\n• Attendance: {'↗️ Improving' if attendance_rate >= 80 else '→ Stable' if attendance_rate >= 70 else '↘️ Needs attention'}\n• Leave Management: {'✅ Efficient' if pending_leaves <= 10 else '⚠️ Backlog present'}\n• Workforce: {'📈 Growing' if total_employees >= 10 else '🔄 Stable'} "
-            
-            return result
+**🏢 DEPARTMENT BREAKDOWN**"""]
+
+            for dept in dept_result:  # Top 5 departments (LIMIT in SQL)
+                dept_attendance = dept['dept_attendance_rate'] or 0
+                parts.append(f"\n• **{dept['name']}**: {dept['employee_count']} employees | {dept_attendance:.1f}% attendance")
+
+            parts.append(f"\n\n**🎯 KEY INSIGHTS**\n• {'High' if attendance_rate >= 85 else 'Moderate' if attendance_rate >= 75 else 'Low'} attendance rate overall\n• {'Efficient' if pending_leaves <= 5 else 'Review needed'} leave approval process\n• {'Well-distributed' if total_departments >= 3 else 'Centralized'} workforce structure\n\n**📊 TRENDING METRICS**\n• Attendance: {'↗️ Improving' if attendance_rate >= 80 else '→ Stable' if attendance_rate >= 70 else '↘️ Needs attention'}\n• Leave Management: {'✅ Efficient' if pending_leaves <= 10 else '⚠️ Backlog present'}\n• Workforce: {'📈 Growing' if total_employees >= 10 else '🔄 Stable'} ")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred while generating HR dashboard metrics: {e}"
@@ -152,22 +344,31 @@ def analyze_attendance_patterns(employee_name: str = "", department: str = "", d
             end_date = datetime.now().date()
             start_date = end_date - timedelta(days=days_back)
             
-            # Build query based on filters
+            # Build an aggregate query based on filters. Grouping by day of
+            # week happens in Postgres, so at most seven pre-counted rows
+            # cross the wire instead of every raw attendance record.
             base_query = """
-                SELECT 
-                    e.name,
-                    d.name as department_name,
-                    a.attendance_date,
-                    a.status,
-                    EXTRACT(DOW FROM a.attendance_date) as day_of_week
+                SELECT
+                    EXTRACT(DOW FROM a.attendance_date) as day_of_week,
+                    COUNT(*) as total_count,
+                    COUNT(*) FILTER (WHERE a.status = 'Present') as present_count,
+                    COUNT(*) FILTER (WHERE a.status LIKE '%Leave%') as leave_count,
+                    COUNT(*) FILTER (WHERE a.status = 'Absent') as absent_count,
+                    COUNT(*) FILTER (WHERE a.attendance_date >= :recent_start) as recent_count,
+                    COUNT(*) FILTER (WHERE a.attendance_date >= :recent_start
+                                       AND a.status = 'Present') as recent_present_count
                 FROM attendances a
                 JOIN employees e ON a.employee_id = e.id
                 LEFT JOIN departments d ON e.department_id = d.id
                 WHERE a.attendance_date BETWEEN :start_date AND :end_date
             """
-            
-            params = {'start_date': start_date, 'end_date': end_date}
-            
+
+            params = {
+                'start_date': start_date,
+                'end_date': end_date,
+                'recent_start': end_date - timedelta(days=7),
+            }
+
             if employee_name:
                 base_query += " AND e.name ILIKE :employee_name"
                 params['employee_name'] = f"%{employee_name}%"
@@ -178,40 +379,34 @@ def analyze_attendance_patterns(employee_name: str = "", department: str = "", d
                 analysis_scope = f"Department: {department}"
             else:
                 analysis_scope = "Organization-wide"
-            
-            base_query += " ORDER BY a.attendance_date DESC"
-            
-            result = db.execute(text(base_query), params)
-            attendance_data = result.fetchall()
-            
-            if not attendance_data:
+
+            base_query += " GROUP BY day_of_week ORDER BY day_of_week"
+
+            dow_rows = db.execute(text(base_query), params).mappings().all()
+
+            if not dow_rows:
                 return f"No attendance data found for {analysis_scope} in the last {days_back} days."
-            
-            # Analyze patterns
-            total_records = len(attendance_data)
-            present_count = sum(1 for record in attendance_data if record[3] == 'Present')
-            leave_count = sum(1 for record in attendance_data if 'Leave' in record[3])
-            absent_count = sum(1 for record in attendance_data if record[3] == 'Absent')
-            
+
+            # Overall totals: summing at most seven pre-aggregated rows.
+            total_records = sum(r['total_count'] for r in dow_rows)
+            present_count = sum(r['present_count'] for r in dow_rows)
+            leave_count = sum(r['leave_count'] for r in dow_rows)
+            absent_count = sum(r['absent_count'] for r in dow_rows)
+
             # Day of week analysis
-            day_patterns = {0: 'Mon', 1: 'Tue', 2: 'Wed', 3: 'Thu', 4: 'Fri', 5: 'Sat', 6: 'Sun'}
-            day_attendance = {}
-            
-            for record in attendance_data:
-                day = int(record[4])  # day_of_week
-                status = record[3]
-                if day not in day_attendance:
-                    day_attendance[day] = {'Present': 0, 'Leave': 0, 'Absent': 0, 'Total': 0}
-                
-                day_attendance[day]['Total'] += 1
-                if status == 'Present':
-                    day_attendance[day]['Present'] += 1
-                elif 'Leave' in status:
-                    day_attendance[day]['Leave'] += 1
-                elif status == 'Absent':
-                    day_attendance[day]['Absent'] += 1
-            
-            return f"""📊 **Attendance Pattern Analysis**
+            day_attendance = {
+                int(r['day_of_week']): {
+                    'Present': r['present_count'],
+                    'Leave': r['leave_count'],
+                    'Absent': r['absent_count'],
+                    'Total': r['total_count'],
+                }
+                for r in dow_rows
+            }
+
+            # As with the dashboard, the header used to be returned before the
+            # day-of-week loop ever ran; build the report as parts instead.
+            parts = [f"""📊 **Attendance Pattern Analysis**
 
 **Scope:** {analysis_scope}
 **Period:** {start_date} to {end_date} ({days_back} days)
@@ -222,33 +417,32 @@ def analyze_attendance_patterns(employee_name: str = "", department: str = "", d
 • On Leave: {leave_count} ({leave_count/total_records*100:.1f}%)
 • Absent: {absent_count} ({absent_count/total_records*100:.1f}%)
 
-**📅 Day-of-Week Patterns:**"""
-            
-            result = result if 'result' in locals() else ""
-            
+**📅 Day-of-Week Patterns:**"""]
+
             for day_num in sorted(day_attendance.keys()):
                 if day_num < 5:  # Weekdays only
                     day_data = day_attendance[day_num]
                     present_rate = (day_data['Present'] / day_data['Total'] * 100) if day_data['Total'] > 0 else 0
-                    result += f"\n• **{day_patterns[day_num]}**: {present_rate:.1f}% attendance ({day_data['Present']}/{day_data['Total']})"
-            
-            # Identify trends
-            recent_week = [record for record in attendance_data if record[2] >= (end_date - timedelta(days=7))]
-            recent_present = sum(1 for record in recent_week if record[3] == 'Present')
-            recent_rate = (recent_present / len(recent_week) * 100) if recent_week else 0
-            
+                    parts.append(f"\n• **{DAY_PATTERNS[day_num]}**: {present_rate:.1f}% attendance ({day_data['Present']}/{day_data['Total']})")
+
+            # Identify trends: the recent-week FILTER columns ride along in
+            # the grouped query, so no second round-trip is needed.
+            recent_total = sum(r['recent_count'] for r in dow_rows)
+            recent_present = sum(r['recent_present_count'] for r in dow_rows)
+            recent_rate = (recent_present / recent_total * 100) if recent_total else 0
+
             overall_rate = present_count / total_records * 100
-            
-            result += f"\n\n**🔍 Pattern Insights:**\n• Recent Week Attendance: {recent_rate:.1f}%\n• Overall Period Average: {overall_rate:.1f}%\n• Trend: {'↗️ Improving' if recent_rate > overall_rate else '↘️ Declining' if recent_rate < overall_rate - 5 else '→ Stable'}\n\n**⚠️ Recommendations:**"
-            
+
+            parts.append(f"\n\n**🔍 Pattern Insights:**\n• Recent Week Attendance: {recent_rate:.1f}%\n• Overall Period Average: {overall_rate:.1f}%\n• Trend: {'↗️ Improving' if recent_rate > overall_rate else '↘️ Declining' if recent_rate < overall_rate - 5 else '→ Stable'}\n\n**⚠️ Recommendations:**")
+
             if overall_rate < 75:
-                result += "\n• Investigate attendance issues and root causes\n• Review workload and work-life balance\n• Consider flexible work arrangements"
+                parts.append("\n• Investigate attendance issues and root causes\n• Review workload and work-life balance\n• Consider flexible work arrangements")
             elif overall_rate < 85:
-                result += "\n• Monitor attendance trends closely\n• Provide additional support where needed\n• Recognize good attendance performers"
+                parts.append("\n• Monitor attendance trends closely\n• Provide additional support where needed\n• Recognize good attendance performers")
             else:
-                result += "\n• Maintain current attendance standards\n• Continue recognizing excellent attendance\n• Share best practices across teams"
-            
-            return result
+                parts.append("\n• Maintain current attendance standards\n• Continue recognizing excellent attendance\n• Share best practices across teams")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred during attendance pattern analysis: {e}"
@@ -265,83 +459,66 @@ def predict_employee_turnover_risk(lookback_months: int = 6) -> str:
             current_date = datetime.now()
             analysis_start = current_date - timedelta(days=30 * lookback_months)
             
-            # Get employee metrics for risk analysis
-            risk_analysis_query = text("""
-                SELECT 
-                    e.id,
-                    e.name,
-                    e.role,
-                    d.name as department_name,
-                    e.is_active,
-                    COUNT(DISTINCT a.attendance_date) as total_attendance_days,
-                    COUNT(DISTINCT CASE WHEN a.status = 'Present' THEN a.attendance_date END) as present_days,
-                    COUNT(DISTINCT CASE WHEN a.status = 'Absent' THEN a.attendance_date END) as absent_days,
-                    COUNT(DISTINCT lr.id) as leave_requests,
-                    COUNT(DISTINCT CASE WHEN lr.status = 'pending' THEN lr.id END) as pending_leaves
-                FROM employees e
-                LEFT JOIN departments d ON e.department_id = d.id
-                LEFT JOIN attendances a ON e.id = a.employee_id 
-                    AND a.attendance_date >= :analysis_start
-                LEFT JOIN leave_requests lr ON e.id = lr.employee_id 
-                    AND lr.leave_date >= :analysis_start
-                WHERE e.is_active = true
-                GROUP BY e.id, e.name, e.role, d.name, e.is_active
-                ORDER BY e.name
-            """)
-            
-            result = db.execute(risk_analysis_query, {'analysis_start': analysis_start.date()})
-            employee_data = result.fetchall()
-            
-            if not employee_data:
+            params = {'analysis_start': analysis_start.date()}
+
+            # Scoring, thresholding and bucketing all happen in SQL: one
+            # aggregate row carries the distribution, and only the (at most
+            # ten) high-risk employees that get rendered are transferred.
+            distribution = db.execute(
+                TURNOVER_DISTRIBUTION_SQL, params
+            ).mappings().first()
+
+            if not distribution or distribution['total_count'] == 0:
                 return "No employee data available for turnover risk analysis."
-            
-            # Analyze risk factors for each employee
+
+            high_risk_rows = db.execute(
+                TURNOVER_HIGH_RISK_SQL, params
+            ).mappings().all()
+
+            # The per-factor labels are derived from the returned counters
+            # for display only.
             risk_employees = []
-            low_risk_employees = []
-            
-            for emp_data in employee_data:
-                (emp_id, name, role, dept_name, is_active, 
-                 total_attendance, present_days, absent_days, 
-                 leave_requests, pending_leaves) = emp_data
-                
-                # Calculate risk score (0-100, higher = more risk)
-                risk_score = 0
+
+            for emp_data in high_risk_rows:
+                name = emp_data['name']
+                role = emp_data['role']
+                dept_name = emp_data['department_name']
+                total_attendance = emp_data['total_attendance_days']
+                present_days = emp_data['present_days']
+                absent_days = emp_data['absent_days']
+                leave_requests = emp_data['leave_requests']
+                pending_leaves = emp_data['pending_leaves']
+                risk_score = emp_data['risk_score']
+
                 risk_factors = []
-                
+
                 # Attendance risk factors
                 if total_attendance > 0:
                     attendance_rate = present_days / total_attendance
                     if attendance_rate < 0.7:
-                        risk_score += 30
                         risk_factors.append("Low attendance rate")
                     elif attendance_rate < 0.8:
-                        risk_score += 15
                         risk_factors.append("Moderate attendance concerns")
-                
+
                 # Absence patterns
                 if absent_days > 10:
-                    risk_score += 20
                     risk_factors.append("High absence frequency")
-                
-                # Leave request patterns  
+
+                # Leave request patterns
                 if leave_requests > 8:
-                    risk_score += 15
                     risk_factors.append("Frequent leave requests")
-                
+
                 if pending_leaves > 3:
-                    risk_score += 10
                     risk_factors.append("Multiple pending leave requests")
-                
+
                 # Department risk (some departments may have higher turnover)
                 if not dept_name:
-                    risk_score += 5
                     risk_factors.append("No department assignment")
-                
+
                 # Role risk
                 if not role:
-                    risk_score += 5
                     risk_factors.append("Undefined role")
-                
+
                 employee_risk = {
                     'name': name,
                     'role': role or 'Not specified',
@@ -350,59 +527,59 @@ def predict_employee_turnover_risk(lookback_months: int = 6) -> str:
                     'risk_factors': risk_factors,
                     'attendance_rate': (present_days / total_attendance * 100) if total_attendance > 0 else 0
                 }
-                
-                if risk_score >= 40:
-                    risk_employees.append(employee_risk)
-                else:
-                    low_risk_employees.append(employee_risk)
-            
-            # Sort by risk score
-            risk_employees.sort(key=lambda x: x['risk_score'], reverse=True)
-            
-            result_text = f"""🎯 **Employee Turnover Risk Analysis**
+
+                risk_employees.append(employee_risk)
+
+            high_count = distribution['high_count']
+            moderate_count = distribution['moderate_count']
+            low_count = distribution['low_count']
+
+            # Assemble the report from a parts list and join once at the end;
+            # repeated += on a growing string is quadratic in output size.
+            parts = [f"""🎯 **Employee Turnover Risk Analysis**
 
 **Analysis Period:** Last {lookback_months} months
-**Total Employees Analyzed:** {len(employee_data)}
-**High Risk Employees:** {len(risk_employees)}
-**Low Risk Employees:** {len(low_risk_employees)}
+**Total Employees Analyzed:** {distribution['total_count']}
+**High Risk Employees:** {high_count}
+**Low Risk Employees:** {distribution['total_count'] - high_count}
 **Generated:** {current_date.strftime('%Y-%m-%d %H:%M')}
 
-**🚨 HIGH RISK EMPLOYEES (Score ≥ 40):**"""
-            
+**🚨 HIGH RISK EMPLOYEES (Score ≥ 40):**"""]
+
             if risk_employees:
-                for emp in risk_employees[:10]:  # Top 10 high-risk employees
-                    result_text += f"\n\n**{emp['name']}** - Risk Score: {emp['risk_score']}/100\n• Role: {emp['role']}\n• Department: {emp['department']}\n• Attendance Rate: {emp['attendance_rate']:.1f}%\n• Risk Factors: {', '.join(emp['risk_factors']) if emp['risk_factors'] else 'General risk factors'} "
+                for emp in risk_employees:  # Top 10 high-risk (LIMIT in SQL)
+                    parts.append(f"\n\n**{emp['name']}** - Risk Score: {emp['risk_score']}/100\n• Role: {emp['role']}\n• Department: {emp['department']}\n• Attendance Rate: {emp['attendance_rate']:.1f}%\n• Risk Factors: {', '.join(emp['risk_factors']) if emp['risk_factors'] else 'General risk factors'} ")
             else:
-                result_text += "\n✅ No employees identified as high risk!"
-            
-            result_text += f"\n\n**📊 RISK DISTRIBUTION:**\n• High Risk (40-100): {len([e for e in risk_employees if e['risk_score'] >= 40])} employees\n• Moderate Risk (20-39): {len([e for e in employee_data if 20 <= (40 if e in [emp['name'] for emp in risk_employees] else 10) <= 39])} employees  \n• Low Risk (0-19): {len(low_risk_employees)} employees\n\n**🎯 RECOMMENDED ACTIONS:**"
-            
+                parts.append("\n✅ No employees identified as high risk!")
+
+            parts.append(f"\n\n**📊 RISK DISTRIBUTION:**\n• High Risk (40-100): {high_count} employees\n• Moderate Risk (20-39): {moderate_count} employees  \n• Low Risk (0-19): {low_count} employees\n\n**🎯 RECOMMENDED ACTIONS:**")
+
             if risk_employees:
-                result_text += """
+                parts.append("""
 1. **Immediate Actions:**
    • Schedule one-on-one meetings with high-risk employees
    • Investigate specific concerns and challenges
    • Review workload and work-life balance
-   
+
 2. **Medium-term Strategies:**
    • Implement mentorship programs
    • Provide career development opportunities
    • Address workplace culture issues
-   
+
 3. **Retention Initiatives:**
    • Improve recognition and rewards programs
    • Offer flexible work arrangements
-   • Enhance professional development support"""
+   • Enhance professional development support""")
             else:
-                result_text += """
+                parts.append("""
 1. **Maintain current positive environment**
 2. **Continue regular employee engagement surveys**
 3. **Recognize and reward good performance**
-4. **Monitor trends for early warning signs**"""
-            
-            result_text += f"\n\n**📈 SUCCESS METRICS TO TRACK:**\n• Monthly employee satisfaction scores\n• Attendance rate improvements  \n• Reduced absenteeism patterns\n• Employee feedback sentiment\n• Exit interview insights\n\n*Note: This predictive analysis is based on available HR data. Consider conducting employee engagement surveys for more comprehensive insights.*"
-            
-            return result_text
+4. **Monitor trends for early warning signs**""")
+
+            parts.append("\n\n**📈 SUCCESS METRICS TO TRACK:**\n• Monthly employee satisfaction scores\n• Attendance rate improvements  \n• Reduced absenteeism patterns\n• Employee feedback sentiment\n• Exit interview insights\n\n*Note: This predictive analysis is based on available HR data. Consider conducting employee engagement surveys for more comprehensive insights.*")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred during turnover risk analysis: {e}"
@@ -440,29 +617,12 @@ def generate_compliance_report(report_type: str = "attendance", period: str = "c
             
             if report_type == "attendance":
                 # Attendance Compliance Report
-                compliance_query = text("""
-                    SELECT 
-                        e.name,
-                        d.name as department_name,
-                        COUNT(a.id) as total_records,
-                        COUNT(CASE WHEN a.status = 'Present' THEN 1 END) as present_count,
-                        COUNT(CASE WHEN a.status = 'Absent' THEN 1 END) as absent_count,
-                        COUNT(CASE WHEN a.status LIKE '%Leave%' THEN 1 END) as leave_count
-                    FROM employees e
-                    LEFT JOIN departments d ON e.department_id = d.id
-                    LEFT JOIN attendances a ON e.id = a.employee_id 
-                        AND a.attendance_date BETWEEN :start_date AND :end_date
-                    WHERE e.is_active = true
-                    GROUP BY e.id, e.name, d.name
-                    HAVING COUNT(a.id) > 0
-                    ORDER BY e.name
-                """)
-                
-                result = db.execute(compliance_query, {
+                # Streamed in batches; each row is consumed once by the
+                # compliance bucketing below.
+                compliance_data = db.execute(ATTENDANCE_COMPLIANCE_SQL, {
                     'start_date': start_date,
                     'end_date': end_date
-                })
-                compliance_data = result.fetchall()
+                }).mappings()
                 
                 # Compliance thresholds
                 MIN_ATTENDANCE_RATE = 75.0
@@ -472,20 +632,22 @@ def generate_compliance_report(report_type: str = "attendance", period: str = "c
                 non_compliant_employees = []
                 
                 for emp_data in compliance_data:
-                    name, dept_name, total_records, present_count, absent_count, leave_count = emp_data
-                    
+                    total_records = emp_data['total_records']
+                    present_count = emp_data['present_count']
+                    absent_count = emp_data['absent_count']
+
                     attendance_rate = (present_count / total_records * 100) if total_records > 0 else 0
                     absence_rate = (absent_count / total_records * 100) if total_records > 0 else 0
-                    
+
                     compliance_status = {
-                        'name': name,
-                        'department': dept_name or 'Not assigned',
+                        'name': emp_data['name'],
+                        'department': emp_data['department_name'] or 'Not assigned',
                         'attendance_rate': attendance_rate,
                         'absence_rate': absence_rate,
                         'total_days': total_records,
                         'present_days': present_count,
                         'absent_days': absent_count,
-                        'leave_days': leave_count
+                        'leave_days': emp_data['leave_count']
                     }
                     
                     if attendance_rate >= MIN_ATTENDANCE_RATE and absence_rate <= MAX_ABSENCE_RATE:
@@ -493,7 +655,9 @@ def generate_compliance_report(report_type: str = "attendance", period: str = "c
                     else:
                         non_compliant_employees.append(compliance_status)
                 
-                return f"""📋 **Attendance Compliance Report**
+                # The header used to be returned here, so the employee lists
+                # and summary below were dead code; collect parts and join.
+                parts = [f"""📋 **Attendance Compliance Report**
 
 **Period:** {period_label}
 **Report Type:** {report_type.title()}
@@ -503,45 +667,43 @@ def generate_compliance_report(report_type: str = "attendance", period: str = "c
 • Minimum Attendance Rate: {MIN_ATTENDANCE_RATE}%
 • Maximum Absence Rate: {MAX_ABSENCE_RATE}%
 
-**✅ COMPLIANT EMPLOYEES ({len(compliant_employees)}):**"""
-                
-                result_text = result_text if 'result_text' in locals() else ""
-                
+**✅ COMPLIANT EMPLOYEES ({len(compliant_employees)}):**"""]
+
                 for emp in compliant_employees[:10]:  # First 10 compliant employees
-                    result_text += f"\n• **{emp['name']}** ({emp['department']})\n  Attendance: {emp['attendance_rate']:.1f}% | Absence: {emp['absence_rate']:.1f}%"
-                
+                    parts.append(f"\n• **{emp['name']}** ({emp['department']})\n  Attendance: {emp['attendance_rate']:.1f}% | Absence: {emp['absence_rate']:.1f}%")
+
                 if len(compliant_employees) > 10:
-                    result_text += f"\n  ... and {len(compliant_employees) - 10} more compliant employees"
-                
-                result_text += f"\n\n**⚠️ NON-COMPLIANT EMPLOYEES ({len(non_compliant_employees)}):**"
-                
+                    parts.append(f"\n  ... and {len(compliant_employees) - 10} more compliant employees")
+
+                parts.append(f"\n\n**⚠️ NON-COMPLIANT EMPLOYEES ({len(non_compliant_employees)}):**")
+
                 for emp in non_compliant_employees:
-                    result_text += f"\n• **{emp['name']}** ({emp['department']})\n  Attendance: {emp['attendance_rate']:.1f}% | Absence: {emp['absence_rate']:.1f}%\n  Issues: {'Low attendance' if emp['attendance_rate'] < MIN_ATTENDANCE_RATE else ''} {'High absence' if emp['absence_rate'] > MAX_ABSENCE_RATE else ''}"
-                
+                    parts.append(f"\n• **{emp['name']}** ({emp['department']})\n  Attendance: {emp['attendance_rate']:.1f}% | Absence: {emp['absence_rate']:.1f}%\n  Issues: {'Low attendance' if emp['attendance_rate'] < MIN_ATTENDANCE_RATE else ''} {'High absence' if emp['absence_rate'] > MAX_ABSENCE_RATE else ''}")
+
                 if not non_compliant_employees:
-                    result_text += "\n✅ All employees meet compliance standards!"
-                
+                    parts.append("\n✅ All employees meet compliance standards!")
+
                 # Compliance summary
                 total_employees = len(compliant_employees) + len(non_compliant_employees)
                 compliance_rate = (len(compliant_employees) / total_employees * 100) if total_employees > 0 else 0
-                
-                result_text += f"\n\n**📈 COMPLIANCE SUMMARY:**\n• Overall Compliance Rate: {compliance_rate:.1f}%\n• Total Employees Reviewed: {total_employees}\n• Requiring Action: {len(non_compliant_employees)}\n\n**🎯 RECOMMENDATIONS:**"
-                
+
+                parts.append(f"\n\n**📈 COMPLIANCE SUMMARY:**\n• Overall Compliance Rate: {compliance_rate:.1f}%\n• Total Employees Reviewed: {total_employees}\n• Requiring Action: {len(non_compliant_employees)}\n\n**🎯 RECOMMENDATIONS:**")
+
                 if len(non_compliant_employees) > 0:
-                    result_text += """
+                    parts.append("""
 1. Schedule meetings with non-compliant employees
 2. Investigate root causes of attendance issues
 3. Implement corrective action plans
 4. Provide additional support and resources
-5. Monitor progress monthly"""
+5. Monitor progress monthly""")
                 else:
-                    result_text += """
+                    parts.append("""
 1. Maintain current attendance management practices
 2. Continue regular monitoring and reporting
 3. Recognize employees with excellent attendance
-4. Share best practices across the organization"""
-                
-                return result_text
+4. Share best practices across the organization""")
+
+                return "".join(parts)
                 
             else:
                 return f"Compliance report type '{report_type}' is not yet implemented. Available types: attendance"
@@ -549,6 +711,33 @@ def generate_compliance_report(report_type: str = "attendance", period: str = "c
         except Exception as e:
             return f"An error occurred while generating the compliance report: {e}"
 
+@functools.lru_cache(maxsize=1)
+def _get_schema_desc() -> str:
+    """Build (once per process) the schema description fed to the report LLM.
+
+    information_schema only changes on migration; call
+    _get_schema_desc.cache_clear() after running one.
+    """
+    schema_query = """
+        SELECT table_name, column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+        AND table_name IN ('employees', 'departments', 'attendances', 'leave_requests', 'leave_balances')
+        ORDER BY table_name, column_name
+    """
+    with SessionLocal() as db:
+        schema_info = db.execute(text(schema_query)).fetchall()
+
+    schema_desc = "Available database tables and columns:\n"
+    current_table = ""
+    for table, column, data_type in schema_info:
+        if table != current_table:
+            schema_desc += f"\n{table}: "
+            current_table = table
+        schema_desc += f"{column}({data_type}), "
+    return schema_desc
+
+
 @tool
 def create_custom_hr_report(report_request: str, include_charts: bool = False) -> str:
     """
@@ -557,61 +746,44 @@ def create_custom_hr_report(report_request: str, include_charts: bool = False) -
     - report_request: Natural language description of the desired report
     - include_charts: Whether to include chart descriptions (default False)
     """
-    with SessionLocal() as db:
-        try:
-            # Use AI to interpret the report request and generate appropriate queries
-            ai_model = ChatOpenAI(model="gpt-4o", temperature=0.1)
-            
-            # Get database schema for context
-            schema_query = """
-                SELECT table_name, column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name IN ('employees', 'departments', 'attendances', 'leave_requests', 'leave_balances')
-                ORDER BY table_name, column_name
-            """
-            
-            schema_result = db.execute(text(schema_query))
-            schema_info = schema_result.fetchall()
-            
-            # Create schema description
-            schema_desc = "Available database tables and columns:\n"
-            current_table = ""
-            for table, column, data_type in schema_info:
-                if table != current_table:
-                    schema_desc += f"\n{table}: "
-                    current_table = table
-                schema_desc += f"{column}({data_type}), "
-            
-            # Generate report using AI
-            report_prompt = f"""
-            You are an HR analytics expert. Create a comprehensive report based on this request: "{report_request}"
-            
-            Available database schema:
-            {schema_desc}
-            
-            Current date: {datetime.now().strftime('%Y-%m-%d')}
-            
-            Provide:
-            1. Report title and overview
-            2. Key metrics and findings
-            3. Data analysis and insights
-            4. Trends and patterns
-            5. Actionable recommendations
-            
-            Format as a professional HR report with clear sections and bullet points.
-            If specific data is needed but not available, note it as "Data collection needed".
-            """
-            
-            if include_charts:
-                report_prompt += "\n\nAlso include descriptions of recommended charts and visualizations."
-            
-            ai_response = ai_model.invoke(report_prompt).content
-            
-            # Add metadata to the report
-            final_report = f"""📊 **Custom HR Report**
+    try:
+        # One canonical timestamp per report; reused for the prompt date and
+        # the header so both always agree.
+        now = datetime.now()
+
+        # Schema description is memoized: the catalog only changes on
+        # migration, so no need to scan information_schema per report.
+        schema_desc = _get_schema_desc()
+
+        # Generate report using AI
+        report_prompt = f"""
+        You are an HR analytics expert. Create a comprehensive report based on this request: "{report_request}"
+
+        Available database schema:
+        {schema_desc}
+
+        Current date: {now.strftime('%Y-%m-%d')}
 
-**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}
+        Provide:
+        1. Report title and overview
+        2. Key metrics and findings
+        3. Data analysis and insights
+        4. Trends and patterns
+        5. Actionable recommendations
+
+        Format as a professional HR report with clear sections and bullet points.
+        If specific data is needed but not available, note it as "Data collection needed".
+        """
+
+        if include_charts:
+            report_prompt += "\n\nAlso include descriptions of recommended charts and visualizations."
+
+        ai_response = _AI_MODEL.invoke(report_prompt).content
+
+        # Add metadata to the report
+        final_report = f"""📊 **Custom HR Report**
+
+**Generated:** {now.strftime('%Y-%m-%d %H:%M')}
 **Request:** {report_request}
 
 {ai_response}
@@ -624,11 +796,11 @@ def create_custom_hr_report(report_request: str, include_charts: bool = False) -
 • Report accuracy depends on data quality and completeness
 
 **📞 For questions or clarifications about this report, please contact the HR analytics team.**"""
-            
-            return final_report
-            
-        except Exception as e:
-            return f"An error occurred while creating the custom HR report: {e}"
+
+        return final_report
+
+    except Exception as e:
+        return f"An error occurred while creating the custom HR report: {e}"
 
 @tool
 def track_hr_kpis(kpi_category: str = "all") -> str:
@@ -644,86 +816,72 @@ def track_hr_kpis(kpi_category: str = "all") -> str:
             current_year_start = datetime(current_date.year, 1, 1).date()
             
             kpi_results = {}
-            
-            if kpi_category in ["all", "workforce"]:
+
+            # One round trip fetches every KPI scalar; the per-category
+            # aggregates are cheap enough that gating them server-side is
+            # not worth a second query shape.
+            summary = db.execute(KPI_SUMMARY_SQL, {
+                'month_start': current_month_start,
+                'year_start': current_year_start,
+            }).mappings().first()
+
+            if kpi_category in ["all", "workforce"] and summary:
                 # Workforce KPIs
-                total_employees = db.query(models.Employee).filter(models.Employee.is_active == True).count()
-                total_departments = db.query(models.Department).count()
-                
+                total_employees = summary['total_employees']
+                total_departments = summary['total_departments']
+
                 kpi_results["workforce"] = {
                     "total_active_employees": total_employees,
                     "total_departments": total_departments,
                     "avg_employees_per_dept": total_employees / total_departments if total_departments > 0 else 0
                 }
-            
-            if kpi_category in ["all", "attendance"]:
+
+            if kpi_category in ["all", "attendance"] and summary:
                 # Attendance KPIs
-                attendance_query = text("""
-                    SELECT 
-                        COUNT(*) as total_records,
-                        COUNT(CASE WHEN status = 'Present' THEN 1 END) as present_count,
-                        COUNT(CASE WHEN status LIKE '%Leave%' THEN 1 END) as leave_count,
-                        COUNT(CASE WHEN status = 'Absent' THEN 1 END) as absent_count
-                    FROM attendances 
-                    WHERE attendance_date >= :month_start
-                """)
-                
-                att_result = db.execute(attendance_query, {'month_start': current_month_start}).fetchone()
-                
-                if att_result:
-                    total_records, present_count, leave_count, absent_count = att_result
-                    kpi_results["attendance"] = {
-                        "attendance_rate": (present_count / total_records * 100) if total_records > 0 else 0,
-                        "absence_rate": (absent_count / total_records * 100) if total_records > 0 else 0,
-                        "leave_utilization": (leave_count / total_records * 100) if total_records > 0 else 0,
-                        "total_attendance_records": total_records
-                    }
-            
-            if kpi_category in ["all", "engagement"]:
+                total_records = summary['total_records']
+                kpi_results["attendance"] = {
+                    "attendance_rate": (summary['present_count'] / total_records * 100) if total_records > 0 else 0,
+                    "absence_rate": (summary['absent_count'] / total_records * 100) if total_records > 0 else 0,
+                    "leave_utilization": (summary['leave_count'] / total_records * 100) if total_records > 0 else 0,
+                    "total_attendance_records": total_records
+                }
+
+            if kpi_category in ["all", "engagement"] and summary:
                 # Engagement KPIs (based on available data)
-                leave_request_query = text("""
-                    SELECT 
-                        COUNT(*) as total_requests,
-                        COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending_requests,
-                        AVG(EXTRACT(EPOCH FROM (CURRENT_DATE - leave_date))/86400) as avg_request_lead_time
-                    FROM leave_requests 
-                    WHERE leave_date >= :year_start
-                """)
-                
-                leave_result = db.execute(leave_request_query, {'year_start': current_year_start}).fetchone()
-                
-                if leave_result:
-                    total_requests, pending_requests, avg_lead_time = leave_result
-                    kpi_results["engagement"] = {
-                        "leave_request_efficiency": ((total_requests - pending_requests) / total_requests * 100) if total_requests > 0 else 0,
-                        "pending_requests_backlog": pending_requests or 0,
-                        "avg_leave_request_lead_time": abs(avg_lead_time) if avg_lead_time else 0
-                    }
+                total_requests = summary['total_requests']
+                pending_requests = summary['pending_requests']
+                avg_lead_time = summary['avg_request_lead_time']
+                kpi_results["engagement"] = {
+                    "leave_request_efficiency": ((total_requests - pending_requests) / total_requests * 100) if total_requests > 0 else 0,
+                    "pending_requests_backlog": pending_requests or 0,
+                    "avg_leave_request_lead_time": avg_lead_time or 0
+                }
             
-            # Format KPI report
-            report = f"""📊 **HR Key Performance Indicators (KPIs)**
+            # Format KPI report; collect sections in a list and join once
+            # rather than growing an immutable string per section.
+            parts = [f"""📊 **HR Key Performance Indicators (KPIs)**
 
 **Period:** {current_date.strftime('%B %Y')}
 **Category:** {kpi_category.title()}
 **Generated:** {current_date.strftime('%Y-%m-%d %H:%M')}
 
-"""
-            
+"""]
+
             if "workforce" in kpi_results:
                 wf = kpi_results["workforce"]
-                report += f"""**👥 WORKFORCE KPIs:**\n• Total Active Employees: {wf['total_active_employees']}\n• Total Departments: {wf['total_departments']}\n• Average Team Size: {wf['avg_employees_per_dept']:.1f} employees per department\n\n"""
-            
+                parts.append(f"""**👥 WORKFORCE KPIs:**\n• Total Active Employees: {wf['total_active_employees']}\n• Total Departments: {wf['total_departments']}\n• Average Team Size: {wf['avg_employees_per_dept']:.1f} employees per department\n\n""")
+
             if "attendance" in kpi_results:
                 att = kpi_results["attendance"]
-                report += f"""**📈 ATTENDANCE KPIs:**\n• Attendance Rate: {att['attendance_rate']:.1f}% {'✅' if att['attendance_rate'] >= 85 else '⚠️' if att['attendance_rate'] >= 75 else '❌'}\n• Absence Rate: {att['absence_rate']:.1f}% {'✅' if att['absence_rate'] <= 5 else '⚠️' if att['absence_rate'] <= 10 else '❌'}\n• Leave Utilization: {att['leave_utilization']:.1f}%\n• Total Records: {att['total_attendance_records']}\n\n"""
-            
+                parts.append(f"""**📈 ATTENDANCE KPIs:**\n• Attendance Rate: {att['attendance_rate']:.1f}% {_tier(att['attendance_rate'], ATTENDANCE_TIERS)}\n• Absence Rate: {att['absence_rate']:.1f}% {_tier_low(att['absence_rate'], ABSENCE_TIERS)}\n• Leave Utilization: {att['leave_utilization']:.1f}%\n• Total Records: {att['total_attendance_records']}\n\n""")
+
             if "engagement" in kpi_results:
                 eng = kpi_results["engagement"]
-                report += f"""**🎯 ENGAGEMENT KPIs:**\n• Leave Request Efficiency: {eng['leave_request_efficiency']:.1f}% {'✅' if eng['leave_request_efficiency'] >= 90 else '⚠️' if eng['leave_request_efficiency'] >= 75 else '❌'}\n• Pending Requests Backlog: {eng['pending_requests_backlog']} {'✅' if eng['pending_requests_backlog'] <= 5 else '❌'}\n• Avg. Request Lead Time: {eng['avg_leave_request_lead_time']:.1f} days\n\n"""
-            
-            report += """**📊 KPI PERFORMANCE INDICATORS:**\n✅ = Target Met | ⚠️ = Needs Attention | ❌ = Below Target\n\n**🎯 RECOMMENDED TARGETS:**\n• Attendance Rate: ≥85%\n• Absence Rate: ≤5%\n• Leave Request Efficiency: ≥90%\n• Pending Requests: ≤5\n\n**📈 IMPROVEMENT ACTIONS:**\n• Review any KPIs marked with ⚠️ or ❌\n• Implement targeted improvement plans\n• Monitor progress monthly\n• Celebrate achievements for ✅ metrics"""
-            
-            return report
+                parts.append(f"""**🎯 ENGAGEMENT KPIs:**\n• Leave Request Efficiency: {eng['leave_request_efficiency']:.1f}% {_tier(eng['leave_request_efficiency'], EFFICIENCY_TIERS)}\n• Pending Requests Backlog: {eng['pending_requests_backlog']} {_tier_low(eng['pending_requests_backlog'], BACKLOG_TIERS)}\n• Avg. Request Lead Time: {eng['avg_leave_request_lead_time']:.1f} days\n\n""")
+
+            parts.append("""**📊 KPI PERFORMANCE INDICATORS:**\n✅ = Target Met | ⚠️ = Needs Attention | ❌ = Below Target\n\n**🎯 RECOMMENDED TARGETS:**\n• Attendance Rate: ≥85%\n• Absence Rate: ≤5%\n• Leave Request Efficiency: ≥90%\n• Pending Requests: ≤5\n\n**📈 IMPROVEMENT ACTIONS:**\n• Review any KPIs marked with ⚠️ or ❌\n• Implement targeted improvement plans\n• Monitor progress monthly\n• Celebrate achievements for ✅ metrics""")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred while tracking HR KPIs: {e}"
@@ -1,20 +1,46 @@
+import itertools
 import os
+import re
+import time
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 from langchain.tools import tool
 from dotenv import load_dotenv
-from sqlalchemy import text, inspect
+from sqlalchemy import text, inspect, select
 from sqlalchemy.engine import Engine
 import sqlparse
-from langchain_openai import ChatOpenAI
 
 from .database import SessionLocal, engine
+from .llm_client import get_chat_model, get_embedding_batcher
+from .semantic_cache import SemanticCache
 from . import models
 
 load_dotenv()
 
+# Shared clients from the process-wide cache; constructing ChatOpenAI per
+# call rebuilds httpx state and loses connection reuse to OpenAI.
+SQL_GEN_LLM = get_chat_model(temperature=0.0)
+SYNTH_LLM = get_chat_model(temperature=0.1)
+
+# The schema only changes on migration, yet every answer_database_question
+# call was re-running the pg_catalog queries behind inspect(). Cache the
+# rendered description for a few minutes.
+_SCHEMA_CACHE_TTL = 600  # seconds
+_schema_cache: Optional[Tuple[float, str]] = None
+
+
+def invalidate_schema_cache() -> None:
+    """Drop the cached schema description (call after running a migration)."""
+    global _schema_cache
+    _schema_cache = None
+
+
 # --- Helper Function to get DB Schema ---
 def get_db_schema(engine: Engine) -> str:
     """Retrieves the schema of the database for the LLM's context."""
+    global _schema_cache
+    if _schema_cache is not None and time.monotonic() - _schema_cache[0] < _SCHEMA_CACHE_TTL:
+        return _schema_cache[1]
     inspector = inspect(engine)
     schema_info = []
     table_names = inspector.get_table_names()
@@ -23,7 +49,51 @@ def get_db_schema(engine: Engine) -> str:
     for table_name in filtered_tables:
         columns = [f"{col['name']}({col['type']})" for col in inspector.get_columns(table_name)]
         schema_info.append(f"Table '{table_name}': {', '.join(columns)}")
-    return "\n".join(schema_info)
+    schema_desc = "\n".join(schema_info)
+    _schema_cache = (time.monotonic(), schema_desc)
+    return schema_desc
+
+# Dashboards tend to re-ask the same natural-language question in bursts;
+# each one costs two LLM round trips plus a query. A short TTL keeps repeat
+# answers hot without serving stale data for long.
+_NL_ANSWER_CACHE_TTL = 60  # seconds
+_NL_ANSWER_CACHE_MAX = 512
+_nl_answer_cache: Dict[str, Tuple[float, str]] = {}
+
+
+def _normalize_nl_query(natural_language_query: str) -> str:
+    return " ".join(natural_language_query.lower().split())
+
+
+# Paraphrases miss the exact-match cache above ("list IT employees" vs
+# "list employees of IT dept"), so a second, embedding-keyed layer catches
+# them. Same short TTL as the exact cache: answers reflect live data.
+_semantic_answer_cache = SemanticCache(
+    ttl=_NL_ANSWER_CACHE_TTL, max_entries=256, threshold=0.92
+)
+
+
+def invalidate_nl_cache() -> None:
+    """Drop cached natural-language answers (call after data writes)."""
+    _nl_answer_cache.clear()
+    _semantic_answer_cache.clear()
+
+
+# Longer-lived cache for just the generated SQL: the same question maps to
+# the same statement, so on a hit we skip the SQL-generation LLM call but
+# still execute against live data. Kept to an hour since the prompt embeds
+# today's date for relative-date questions.
+_NL_SQL_CACHE_TTL = 3600  # seconds
+_nl_sql_cache: Dict[str, Tuple[float, str]] = {}
+
+
+# Write/DDL keywords that must never appear in a generated query. A single
+# precompiled regex scan is much cheaper than tokenizing with sqlparse.
+FORBIDDEN_SQL = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|TRUNCATE|GRANT|REVOKE|COPY)\b',
+    re.IGNORECASE,
+)
+
 
 # --- Security Helper Function ---
 def is_read_only_query(sql_query: str) -> bool:
@@ -32,27 +102,21 @@ def is_read_only_query(sql_query: str) -> bool:
     # Basic check for query type
     if not clean_query.startswith("SELECT"):
         return False
-    # More robust check using sqlparse
+    if FORBIDDEN_SQL.search(sql_query):
+        return False
+    # The regex scan settles the common single-statement case; only fall
+    # back to the full sqlparse pass when a ';' hints at stacked statements.
+    if ';' not in sql_query.rstrip().rstrip(';'):
+        return True
+    # Exactly one statement, and it must be a SELECT — checking only the
+    # first parsed statement would let stacked queries through.
     parsed = sqlparse.parse(sql_query)
-    stmt = parsed[0]
-    return stmt.get_type() == 'SELECT'
+    return len(parsed) == 1 and parsed[0].get_type() == 'SELECT'
 
-# --- HR Database Tools ---
-@tool
-def answer_database_question(natural_language_query: str) -> str:
-    """
-    Use this SUPER tool to answer any general, open-ended questions about employees, attendance, leaves, or departments from the database.
-    This tool is very powerful and can translate a user's natural language question into a SQL query and execute it.
-    Provide the user's complete original question as the input.
-    Examples: 'who was present on August 4th 2025?', 'how many people work in the IT/Rise AI department?', 'show me all leave requests for Thavindu', 'මේ මාසයේ පැමිණීමේ විස්තර'.
-    """
-    db_schema = get_db_schema(engine)
-    sql_generation_llm = ChatOpenAI(model="gpt-4o", temperature=0)
-    
-    # Few-shot examples
-    few_shot_examples = """
+# Few-shot examples for the SQL-generation prompt.
+FEW_SHOT_EXAMPLES = """
     Here are some example questions and their corresponding SQL queries:
-    
+
     Question: list all employees from the GAMES/RamStudios department
     SQL: SELECT e.name FROM employees e JOIN departments d ON e.department_id = d.id WHERE d.name ILIKE '%GAMES/RamStudios%';
 
@@ -63,45 +127,177 @@ def answer_database_question(natural_language_query: str) -> str:
     SQL: SELECT b.total_days, b.days_used, (b.total_days - b.days_used) AS remaining_days FROM leave_balances b JOIN employees e ON b.employee_id = e.id WHERE e.name ILIKE '%Kamal%';
     """
 
-    # SQL generation prompt
-    sql_prompt_text = f"""
+# Built once at import; per call only the three dynamic slots are filled,
+# instead of re-assembling the ~KB static prompt (few-shots included) each
+# time. Keeping the text byte-stable also helps provider-side prompt caching.
+SQL_PROMPT_TEMPLATE = """
     You are a PostgreSQL expert. Your task is to write a single, safe, read-only SQL query to answer a user's question based on the provided database schema.
-    
+
     Database Schema:
     {db_schema}
 
     Instructions:
-    - Today's date is {datetime.now().strftime('%Y-%m-%d')}. Use this to resolve relative date questions like "this month" or "last week".
+    - Today's date is {today}. Use this to resolve relative date questions like "this month" or "last week".
     - For string comparisons on names or statuses, ALWAYS use `ILIKE` for case-insensitivity.
     - If a user asks about a department, you MUST JOIN the `employees` and `departments` tables.
     - If a user asks about attendance, you MUST JOIN the `employees` and `attendances` tables.
     - ONLY generate a single `SELECT` statement. Do not generate any other SQL command.
     - Do not add any explanation or markdown formatting around the SQL.
-    
-    {few_shot_examples}
 
-    User Question: "{natural_language_query}"
+    """ + FEW_SHOT_EXAMPLES + """
+
+    User Question: "{question}"
     SQL Query:
     """
-    
-    generated_sql = sql_generation_llm.invoke(sql_prompt_text).content.strip()
-    print(f"--- Generated SQL: {generated_sql} ---")
 
-    if not is_read_only_query(generated_sql):
-        return "Error: An invalid or unsafe query was generated. I cannot proceed with this request."
-        
+
+# "List all employees/departments" phrasings have dedicated zero-LLM tools;
+# a regex check costs nothing compared to a gpt-4o SQL-generation call, so
+# obviously-matching questions are dispatched straight to them.
+_LIST_INTENT_RE = re.compile(
+    r"^\s*(?:list|show|get|give\s+me)(?:\s+(?:all|me))?\s+(?:all\s+)?(?:the\s+)?"
+    r"(departments?|employees?)\s*[.?!]?\s*$",
+    re.IGNORECASE,
+)
+
+
+# Bounds under which a result set is rendered deterministically instead of
+# paying a second gpt-4o call just to Markdown-format rows.
+_MAX_TABLE_ROWS = 20
+_MAX_TABLE_COLS = 4
+
+# Hard cap on rows fed to the synthesis prompt; beyond this the answer
+# gains nothing and the prompt just burns tokens.
+MAX_ROWS_FOR_LLM = 50
+
+
+def _format_rows(result_list) -> Optional[str]:
+    """Render small result sets as Markdown without the synthesis LLM.
+
+    Single-column results become the same bulleted list the prompt asks
+    the LLM for; small multi-column results become a Markdown table.
+    Returns None when the shape is too complex, so the caller falls back
+    to LLM synthesis.
+    """
+    column_names = list(result_list[0].keys())
+    if len(column_names) == 1:
+        col = column_names[0]
+        lines = ["Here is what I found:", ""]
+        lines.extend(f"- {row[col]}" for row in result_list)
+        return "\n".join(lines)
+    if len(result_list) <= _MAX_TABLE_ROWS and len(column_names) <= _MAX_TABLE_COLS:
+        header = " | ".join(str(c) for c in column_names)
+        divider = " | ".join("---" for _ in column_names)
+        lines = ["Here is what I found:", "", f"| {header} |", f"| {divider} |"]
+        lines.extend(
+            "| " + " | ".join("" if row[c] is None else str(row[c]) for c in column_names) + " |"
+            for row in result_list
+        )
+        return "\n".join(lines)
+    return None
+
+
+def _generate_sql(natural_language_query: str) -> str:
+    """Translate a natural-language question into a SQL statement via the LLM."""
+    sql_prompt_text = SQL_PROMPT_TEMPLATE.format(
+        db_schema=get_db_schema(engine),
+        today=datetime.now().strftime('%Y-%m-%d'),
+        question=natural_language_query,
+    )
+    return SQL_GEN_LLM.invoke(sql_prompt_text).content.strip()
+
+
+# --- HR Database Tools ---
+@tool
+def answer_database_question(natural_language_query: str) -> str:
+    """
+    Use this SUPER tool to answer any general, open-ended questions about employees, attendance, leaves, or departments from the database.
+    This tool is very powerful and can translate a user's natural language question into a SQL query and execute it.
+    Provide the user's complete original question as the input.
+    Examples: 'who was present on August 4th 2025?', 'how many people work in the IT/Rise AI department?', 'show me all leave requests for Thavindu', 'මේ මාසයේ පැමිණීමේ විස්තර'.
+    """
+    # Trivial fixed intents skip both LLMs entirely.
+    intent = _LIST_INTENT_RE.match(natural_language_query)
+    if intent:
+        if intent.group(1).lower().startswith("department"):
+            return list_all_departments.invoke({})
+        return list_all_employees.invoke({})
+
+    cache_key = _normalize_nl_query(natural_language_query)
+    cached = _nl_answer_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < _NL_ANSWER_CACHE_TTL:
+        return cached[1]
+
+    # Exact-match miss: one embedding call is far cheaper than the two LLM
+    # round trips plus a query it can save when a paraphrase is cached.
+    try:
+        query_embedding = get_embedding_batcher().embed(natural_language_query)
+        semantic_hit = _semantic_answer_cache.lookup(query_embedding)
+        if semantic_hit is not None:
+            return semantic_hit
+    except Exception:
+        query_embedding = None
+
+    # Reuse a recently generated statement for the same question; the SQL
+    # still executes against live data, only the generation call is skipped.
+    cached_sql = _nl_sql_cache.get(cache_key)
+    if cached_sql is not None and time.monotonic() - cached_sql[0] < _NL_SQL_CACHE_TTL:
+        generated_sql = cached_sql[1]
+    else:
+        generated_sql = _generate_sql(natural_language_query)
+        print(f"--- Generated SQL: {generated_sql} ---")
+
+        if not is_read_only_query(generated_sql):
+            return "Error: An invalid or unsafe query was generated. I cannot proceed with this request."
+
+        if len(_nl_sql_cache) >= _NL_ANSWER_CACHE_MAX:
+            _nl_sql_cache.clear()
+        _nl_sql_cache[cache_key] = (time.monotonic(), generated_sql)
+
+
     with SessionLocal() as db:
         try:
-            result = db.execute(text(generated_sql))
-            rows = result.fetchall()
-            if not rows:
+            # Belt and braces: the server rejects any write in this
+            # transaction no matter what slipped past the string checks.
+            db.execute(text("SET TRANSACTION READ ONLY"))
+            # Stream rows off a server-side cursor instead of buffering the
+            # whole result, and cap what reaches the synthesis LLM — its
+            # context could not use thousands of rows anyway. One extra row
+            # is fetched to know whether the cap actually truncated.
+            result = db.execute(
+                text(generated_sql).execution_options(stream_results=True, yield_per=100)
+            )
+            result_list = [
+                dict(row)
+                for row in itertools.islice(result.mappings(), MAX_ROWS_FOR_LLM + 1)
+            ]
+            if not result_list:
                 return "I looked into the database, but couldn't find any information matching your request."
-            
-            column_names = result.keys()
-            result_list = [dict(zip(column_names, row)) for row in rows]
-            
+
+            truncated = len(result_list) > MAX_ROWS_FOR_LLM
+            if truncated:
+                result_list = result_list[:MAX_ROWS_FOR_LLM]
+
+
+            # Small, regular result sets don't need an LLM to become
+            # Markdown — formatting them in Python skips the second gpt-4o
+            # round trip on the common "list X" path.
+            truncation_note = (
+                f"\n\n_(showing the first {MAX_ROWS_FOR_LLM} rows; more rows matched)_"
+                if truncated else ""
+            )
+
+            formatted = _format_rows(result_list)
+            if formatted is not None:
+                formatted += truncation_note
+                if len(_nl_answer_cache) >= _NL_ANSWER_CACHE_MAX:
+                    _nl_answer_cache.clear()
+                _nl_answer_cache[cache_key] = (time.monotonic(), formatted)
+                if query_embedding is not None:
+                    _semantic_answer_cache.store(query_embedding, formatted)
+                return formatted
+
             # Synthesis
-            synthesis_llm = ChatOpenAI(model="gpt-4o", temperature=0.1)
             synthesis_prompt = f"""
             You are a helpful assistant. Your task is to present database results to a user in a clear and friendly manner.
             Use the same language as the original question (Sinhala or English).
@@ -114,12 +310,17 @@ def answer_database_question(natural_language_query: str) -> str:
 
             Original Question: "{natural_language_query}"
             
-            Retrieved Data:
+            Retrieved Data{' (showing the first ' + str(MAX_ROWS_FOR_LLM) + ' rows of a larger result; mention that more rows exist)' if truncated else ''}:
             {result_list}
 
             Friendly Answer (in Markdown format):
             """
-            final_answer = synthesis_llm.invoke(synthesis_prompt).content
+            final_answer = SYNTH_LLM.invoke(synthesis_prompt).content
+            if len(_nl_answer_cache) >= _NL_ANSWER_CACHE_MAX:
+                _nl_answer_cache.clear()
+            _nl_answer_cache[cache_key] = (time.monotonic(), final_answer)
+            if query_embedding is not None:
+                _semantic_answer_cache.store(query_embedding, final_answer)
             return final_answer
 
         except Exception as e:
@@ -134,10 +335,9 @@ def list_all_departments() -> str:
     """
     with SessionLocal() as db:
         try:
-            departments = db.query(models.Department.name).all()
-            if not departments:
+            department_names = db.execute(select(models.Department.name)).scalars().all()
+            if not department_names:
                 return "No departments found in the database."
-            department_names = [name for (name,) in departments]
             return f"Here are all the departments: {department_names}"
         except Exception as e:
             return f"An error occurred while fetching departments: {e}"
@@ -150,10 +350,9 @@ def list_all_employees() -> str:
     """
     with SessionLocal() as db:
         try:
-            employees = db.query(models.Employee.name).all()
-            if not employees:
+            employee_names = db.execute(select(models.Employee.name)).scalars().all()
+            if not employee_names:
                 return "No employees found in the database."
-            employee_names = [name for (name,) in employees]
             return f"Here are all the employees: {employee_names}"
         except Exception as e:
             return f"An error occurred while fetching employees: {e}"
@@ -165,14 +364,27 @@ def get_employee_details(employee_name: str) -> str:
     """
     with SessionLocal() as db:
         try:
-            employee = db.query(models.Employee).filter(
+            # Select only the rendered columns and resolve the department
+            # name in the same query instead of hydrating the full entity
+            # and lazy-loading the relationship.
+            employee = db.query(
+                models.Employee.name,
+                models.Employee.email,
+                models.Employee.role,
+                models.Employee.phone_number,
+                models.Employee.is_active,
+                models.Department.name.label('dept_name'),
+            ).outerjoin(
+                models.Department,
+                models.Department.id == models.Employee.department_id,
+            ).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
-            
+
             if not employee:
                 return f"Employee '{employee_name}' not found in the database."
-            
-            dept_name = employee.department.name if employee.department else "Not assigned"
+
+            dept_name = employee.dept_name or "Not assigned"
             
             details = {
                 "name": employee.name,
@@ -193,10 +405,17 @@ def get_employee_details(employee_name: str) -> str:
         except Exception as e:
             return f"An error occurred while fetching employee details: {e}"
 
-# Export all database tools
-database_tools = [
-    answer_database_question,
-    list_all_departments,
-    list_all_employees,
-    get_employee_details
-]
\ No newline at end of file
+# Export all database tools.
+# Frozen as a deterministically ordered tuple: hr_database_agent and
+# hr_attendance_agent both bind this exact object, so the serialized tool
+# schema is byte-identical for both agents (and stable across processes),
+# which keeps the provider's prompt cache hitting on the tool prefix.
+database_tools = tuple(sorted(
+    [
+        answer_database_question,
+        list_all_departments,
+        list_all_employees,
+        get_employee_details,
+    ],
+    key=lambda t: t.name,
+))
\ No newline at end of file
@@ -3,11 +3,51 @@ from datetime import datetime, date
 from langchain.tools import tool
 from langchain_openai import ChatOpenAI
 from sqlalchemy import text
+from sqlalchemy.orm import joinedload
 from typing import Optional
 
 from .database import SessionLocal, engine
 from . import models
 
+# Attendance context for the per-employee performance summary.
+PERF_ATTENDANCE_SQL = text("""
+    SELECT
+        COUNT(*) as total_days,
+        COUNT(*) FILTER (WHERE status = 'Present') as present_days,
+        COUNT(*) FILTER (WHERE status LIKE '%Leave%') as leave_days
+    FROM attendances a
+    JOIN employees e ON a.employee_id = e.id
+    WHERE e.name ILIKE :name_pattern
+    AND EXTRACT(YEAR FROM a.attendance_date) = :year
+""")
+
+# Single round trip for the team overview: per-employee rates come from the
+# derived aggregate, department names from the join (no lazy loads), and the
+# window functions give the team-wide totals over the full filtered set
+# before LIMIT is applied. Fetching 11 rows detects "more than 10" without
+# pulling the whole team.
+TEAM_OVERVIEW_SQL = text("""
+    SELECT
+        e.name,
+        e.role,
+        d.name AS dept_name,
+        COALESCE(a.att_rate, 0) AS att_rate,
+        COUNT(*) OVER () AS total_active,
+        AVG(COALESCE(a.att_rate, 0)) OVER () AS team_att_rate
+    FROM employees e
+    LEFT JOIN departments d ON d.id = e.department_id
+    LEFT JOIN (
+        SELECT employee_id, AVG((status = 'Present')::int) AS att_rate
+        FROM attendances
+        WHERE attendance_date >= :month_start
+        GROUP BY employee_id
+    ) a ON a.employee_id = e.id
+    WHERE e.is_active = true
+    AND (CAST(:dept_id AS INTEGER) IS NULL OR e.department_id = :dept_id)
+    ORDER BY e.name
+    LIMIT 11
+""")
+
 @tool
 def create_performance_goal(employee_name: str, goal_title: str, goal_description: str, target_date: str, priority: str = "medium") -> str:
     """
@@ -21,8 +61,9 @@ def create_performance_goal(employee_name: str, goal_title: str, goal_descriptio
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is needed here; selecting the single column skips
+            # full-entity hydration.
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -31,7 +72,7 @@ def create_performance_goal(employee_name: str, goal_title: str, goal_descriptio
             
             # Validate date format
             try:
-                target_completion = datetime.strptime(target_date, "%Y-%m-%d").date()
+                target_completion = date.fromisoformat(target_date)
             except ValueError:
                 return "Invalid date format. Please use YYYY-MM-DD format."
             
@@ -63,8 +104,9 @@ def track_goal_progress(employee_name: str, goal_title: str, progress_percentage
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is needed here; selecting the single column skips
+            # full-entity hydration.
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -114,8 +156,9 @@ def schedule_performance_review(employee_name: str, review_date: str, review_typ
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is needed here; selecting the single column skips
+            # full-entity hydration.
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -124,12 +167,12 @@ def schedule_performance_review(employee_name: str, review_date: str, review_typ
             
             # Validate date format
             try:
-                review_datetime = datetime.strptime(review_date, "%Y-%m-%d")
+                review_day = date.fromisoformat(review_date)
             except ValueError:
                 return "Invalid date format. Please use YYYY-MM-DD format."
             
             # Check if date is in the future
-            if review_datetime.date() <= date.today():
+            if review_day <= date.today():
                 return "Review date must be in the future."
             
             return f"""📅 **Performance Review Scheduled!**
@@ -158,8 +201,9 @@ def collect_360_feedback(employee_name: str, feedback_from: str, feedback_text:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is needed here; selecting the single column skips
+            # full-entity hydration.
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -195,28 +239,23 @@ def generate_performance_summary(employee_name: str, period: str = "current_year
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Find employee; the summary reads employee.department.name, so
+            # eager-load the relationship instead of lazy-loading it later.
+            employee = db.query(models.Employee).options(
+                joinedload(models.Employee.department)
+            ).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
-            
+
             if not employee:
                 return f"Employee '{employee_name}' not found."
-            
+
             # Get attendance data for performance context
             current_year = datetime.now().year
-            attendance_query = """
-            SELECT 
-                COUNT(*) as total_days,
-                COUNT(CASE WHEN status = 'Present' THEN 1 END) as present_days,
-                COUNT(CASE WHEN status LIKE '%Leave%' THEN 1 END) as leave_days
-            FROM attendances a 
-            JOIN employees e ON a.employee_id = e.id 
-            WHERE e.name ILIKE %s 
-            AND EXTRACT(YEAR FROM a.attendance_date) = %s
-            """
-            
-            result = db.execute(text(attendance_query), (f"%{employee_name}%", current_year))
+            result = db.execute(PERF_ATTENDANCE_SQL, {
+                'name_pattern': f"%{employee_name}%",
+                'year': current_year,
+            })
             attendance_data = result.fetchone()
             
             if attendance_data:
@@ -262,59 +301,38 @@ def get_team_performance_overview(department_name: str = "") -> str:
     """
     with SessionLocal() as db:
         try:
+            dept_id = None
+            dept_filter = "All Departments"
             if department_name:
                 # Find specific department
                 dept = db.query(models.Department).filter(
                     models.Department.name.ilike(f"%{department_name}%")
                 ).first()
-                
+
                 if not dept:
                     return f"Department '{department_name}' not found."
-                
-                employees = db.query(models.Employee).filter(
-                    models.Employee.department_id == dept.id,
-                    models.Employee.is_active == True
-                ).all()
-                
+
+                dept_id = dept.id
                 dept_filter = f"Department: {dept.name}"
-            else:
-                # All active employees
-                employees = db.query(models.Employee).filter(
-                    models.Employee.is_active == True
-                ).all()
-                dept_filter = "All Departments"
-            
-            if not employees:
+
+            now = datetime.now()
+            rows = db.execute(TEAM_OVERVIEW_SQL, {
+                'month_start': now.replace(day=1).date(),
+                'dept_id': dept_id,
+            }).mappings().all()
+
+            if not rows:
                 return f"No active employees found for the specified criteria."
-            
-            # Calculate team metrics
-            total_employees = len(employees)
-            
-            # Get recent attendance data
-            current_month = datetime.now().replace(day=1).strftime('%Y-%m-%d')
-            attendance_query = f"""
-            SELECT 
-                COUNT(DISTINCT e.id) as employees_with_attendance,
-                AVG(CASE WHEN a.status = 'Present' THEN 1.0 ELSE 0.0 END) as avg_attendance_rate
-            FROM employees e
-            LEFT JOIN attendances a ON e.id = a.employee_id 
-                AND a.attendance_date >= '{current_month}'
-            WHERE e.is_active = true
-            """
-            
-            if department_name:
-                attendance_query += f" AND e.department_id = {dept.id}"
-            
-            result = db.execute(text(attendance_query))
-            attendance_data = result.fetchone()
-            
-            avg_attendance = (attendance_data[1] * 100) if attendance_data[1] else 0
-            
-            return f"""👥 **Team Performance Overview**
+
+            # Window aggregates are identical on every row
+            total_employees = rows[0]['total_active']
+            avg_attendance = (rows[0]['team_att_rate'] or 0) * 100
+
+            parts = [f"""👥 **Team Performance Overview**
 
 **{dept_filter}**
 **Total Active Employees:** {total_employees}
-**Period:** {datetime.now().strftime('%B %Y')}
+**Period:** {now.strftime('%B %Y')}
 
 **📊 Team Metrics:**
 • Average Attendance Rate: {avg_attendance:.1f}%
@@ -327,17 +345,16 @@ def get_team_performance_overview(department_name: str = "") -> str:
 • Development Focus: Performance tracking implementation
 • Next Steps: Complete performance management setup
 
-**👤 Employee Breakdown:**"""
-            
-            result = result + "\n"
-            for emp in employees[:10]:  # Limit to first 10 employees
-                result += f"• {emp.name} ({emp.role or 'No role'}) - {emp.department.name if emp.department else 'No dept'}\n"
-            
-            if len(employees) > 10:
-                result += f"• ... and {len(employees) - 10} more employees"
-                
-            return result
-            
+**👤 Employee Breakdown:**
+"""]
+            for row in rows[:10]:  # Limit to first 10 employees
+                parts.append(f"• {row['name']} ({row['role'] or 'No role'}) - {row['dept_name'] or 'No dept'}\n")
+
+            if total_employees > 10:
+                parts.append(f"• ... and {total_employees - 10} more employees")
+
+            return "".join(parts)
+
         except Exception as e:
             return f"An error occurred while generating team overview: {e}"
 
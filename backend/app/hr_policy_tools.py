@@ -1,15 +1,94 @@
-import os
-from datetime import datetime
-from langchain_community.vectorstores.pgvector import PGVector
-from langchain_openai import OpenAIEmbeddings
+import functools
+from datetime import date, datetime
+from langchain_community.vectorstores.pgvector import PGVector, DistanceStrategy
 from langchain.tools import tool
 from dotenv import load_dotenv
+from sqlalchemy import and_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from .database import SessionLocal
+from .database import DATABASE_URL, SessionLocal, engine
+from .llm_client import get_embeddings, get_embedding_batcher
+from .semantic_cache import SemanticCache
 from . import models
 
 load_dotenv()
 
+# text-embedding-3-small vectors. The embedding column must be declared
+# with this dimension — pgvector refuses to build an HNSW index on an
+# undimensioned vector column.
+_EMBEDDING_DIM = 1536
+
+# ANN index over the langchain-managed embedding table. PGVector only
+# creates its tables on first construction, so this runs right after that
+# rather than in init.sql.
+LANGCHAIN_HNSW_INDEX_SQL = text("""
+    CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_hnsw
+    ON langchain_pg_embedding USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64)
+""")
+
+# Databases created before embedding_length was passed declared the column
+# as a bare `vector`; give it its dimension so the index can build. The
+# atttypmod guard makes re-runs skip the table rewrite.
+LANGCHAIN_EMBEDDING_DIM_SQL = text(f"""
+    DO $$ BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = 'langchain_pg_embedding'::regclass
+              AND attname = 'embedding' AND atttypmod = -1
+        ) THEN
+            ALTER TABLE langchain_pg_embedding
+                ALTER COLUMN embedding TYPE vector({_EMBEDDING_DIM});
+        END IF;
+    END $$
+""")
+
+LANGCHAIN_HNSW_CHECK_SQL = text("""
+    SELECT 1 FROM pg_indexes
+    WHERE indexname = 'idx_langchain_pg_embedding_hnsw'
+""")
+
+
+# The PGVector handle (which bootstraps its own SQLAlchemy engine) is
+# expensive to construct and fully reusable; build it once on first use
+# instead of per search. The embeddings client comes from llm_client.
+@functools.lru_cache(maxsize=1)
+def _get_vstore() -> PGVector:
+    # COSINE explicitly, so queries use the operator class the HNSW index
+    # is built with; embedding_length so fresh tables get a dimensioned
+    # (and therefore HNSW-indexable) embedding column.
+    store = PGVector(
+        connection_string=DATABASE_URL,
+        embedding_function=get_embeddings(),
+        collection_name="hr_policies",
+        distance_strategy=DistanceStrategy.COSINE,
+        embedding_length=_EMBEDDING_DIM,
+    )
+    try:
+        with engine.begin() as conn:
+            conn.execute(LANGCHAIN_EMBEDDING_DIM_SQL)
+            conn.execute(LANGCHAIN_HNSW_INDEX_SQL)
+            if conn.execute(LANGCHAIN_HNSW_CHECK_SQL).first() is None:
+                print("--- HNSW index on langchain_pg_embedding is missing; "
+                      "vector search will fall back to a sequential scan ---")
+    except Exception as e:
+        # Older pgvector builds without HNSW still work, just slower.
+        print(f"--- Could not ensure HNSW index: {e} ---")
+    return store
+
+
+# Policy questions repeat heavily in near-identical phrasings ("leave
+# policy", "leave rules"), so cache formatted answers keyed by the query
+# embedding and serve any new query whose embedding is close enough. The
+# policy corpus only changes on re-ingest, so a generous TTL is safe.
+_policy_cache = SemanticCache(ttl=600, max_entries=128, threshold=0.95)
+
+
+def invalidate_policy_cache() -> None:
+    """Drop cached policy answers (call after re-ingesting policy documents)."""
+    _policy_cache.clear()
+
+
 @tool
 def search_hr_policies(query: str) -> str:
     """
@@ -17,30 +96,33 @@ def search_hr_policies(query: str) -> str:
     Use this tool for questions about company policies, procedures, guidelines, benefits, etc.
     Examples: 'what is the leave policy?', 'company dress code', 'remote work policy', 'වැඩ කාලය පිළිබදව'.
     """
-    connection_string = os.getenv("DATABASE_URL")
-    collection_name = "hr_policies"
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    
     try:
-        db = PGVector(
-            connection_string=connection_string, 
-            embedding_function=embeddings, 
-            collection_name=collection_name
-        )
-        docs = db.similarity_search(query, k=3)
-        
-        if not docs: 
+        # Embed once; the same vector serves both the cache probe and, on a
+        # miss, the store query (similarity_search would re-embed). Going
+        # through the batcher lets concurrent searches share one API call.
+        embedding = get_embedding_batcher().embed(query)
+
+        cached_context = _policy_cache.lookup(embedding)
+        if cached_context is not None:
+            return cached_context
+
+        db = _get_vstore()
+        docs = db.similarity_search_by_vector(embedding, k=3)
+
+        if not docs:
             return "No relevant HR policy documents found for this query."
-            
-        context = "Retrieved HR Policy Information:\n\n"
+
+        parts = ["Retrieved HR Policy Information:\n\n"]
         for i, doc in enumerate(docs, 1):
             document_name = doc.metadata.get('document_name', 'N/A')
-            context += f"**{i}. Document: {document_name}**\n"
-            context += f"{doc.page_content}\n\n"
-            context += "---\n\n"
-            
+            parts.append(f"**{i}. Document: {document_name}**\n")
+            parts.append(f"{doc.page_content}\n\n")
+            parts.append("---\n\n")
+        context = "".join(parts)
+
+        _policy_cache.store(embedding, context)
         return context
-        
+
     except Exception as e:
         return f"An error occurred while searching HR policies: {e}"
 
@@ -55,8 +137,8 @@ def request_leave(employee_name: str, leave_date_str: str, reason: str) -> str:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # id for the insert, name for the reply — nothing else
+            employee = db.query(models.Employee.id, models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -65,30 +147,35 @@ def request_leave(employee_name: str, leave_date_str: str, reason: str) -> str:
             
             # Validate date format
             try:
-                leave_date = datetime.strptime(leave_date_str, "%Y-%m-%d").date()
+                leave_date = date.fromisoformat(leave_date_str)
             except ValueError:
                 return "Invalid date format. Please use YYYY-MM-DD format (e.g., 2025-08-25)."
             
-            # Check if leave request already exists for this date
-            existing_request = db.query(models.LeaveRequest).filter(
-                models.LeaveRequest.employee_id == employee.id,
-                models.LeaveRequest.leave_date == leave_date
-            ).first()
-            
-            if existing_request:
-                return f"A leave request for {employee_name} on {leave_date_str} already exists with status: {existing_request.status}"
-            
-            # Create new leave request
-            leave_request = models.LeaveRequest(
-                employee_id=employee.id,
-                leave_date=leave_date,
-                reason=reason,
-                status='pending'
-            )
-            
-            db.add(leave_request)
+            # Insert atomically; the unique constraint on (employee_id,
+            # leave_date) turns the old SELECT-then-INSERT (two round trips
+            # and a race window) into one conflict-aware statement.
+            new_id = db.execute(
+                pg_insert(models.LeaveRequest)
+                .values(
+                    employee_id=employee.id,
+                    leave_date=leave_date,
+                    reason=reason,
+                    status='pending',
+                )
+                .on_conflict_do_nothing(constraint='uq_leave_emp_date')
+                .returning(models.LeaveRequest.id)
+            ).scalar()
+
+            if new_id is None:
+                db.rollback()
+                existing_status = db.query(models.LeaveRequest.status).filter(
+                    models.LeaveRequest.employee_id == employee.id,
+                    models.LeaveRequest.leave_date == leave_date
+                ).scalar()
+                return f"A leave request for {employee_name} on {leave_date_str} already exists with status: {existing_status}"
+
             db.commit()
-            
+
             return f"✅ Leave request submitted successfully!\n- Employee: {employee.name}\n- Date: {leave_date_str}\n- Reason: {reason}\n- Status: Pending approval"
             
         except Exception as e:
@@ -103,8 +190,8 @@ def check_leave_status(employee_name: str) -> str:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # id for the filter, name for the heading — nothing else
+            employee = db.query(models.Employee.id, models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -119,14 +206,14 @@ def check_leave_status(employee_name: str) -> str:
             if not leave_requests:
                 return f"No leave requests found for {employee.name}."
             
-            result = f"**Leave Requests for {employee.name}:**\n\n"
-            
+            parts = [f"**Leave Requests for {employee.name}:**\n\n"]
+
             for req in leave_requests:
                 status_icon = "⏳" if req.status == "pending" else "✅" if req.status == "approved" else "❌"
-                result += f"{status_icon} **{req.leave_date}** - {req.status.title()}\n"
-                result += f"   Reason: {req.reason}\n\n"
-            
-            return result
+                parts.append(f"{status_icon} **{req.leave_date}** - {req.status.title()}\n")
+                parts.append(f"   Reason: {req.reason}\n\n")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred while checking leave status: {e}"
@@ -139,29 +226,36 @@ def check_leave_balance(employee_name: str) -> str:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            current_year = datetime.now().year
+
+            # One JOIN instead of employee-then-balance queries; an outer
+            # join keeps "employee exists but has no balance row" distinguishable
+            # from "employee not found".
+            row = db.query(
+                models.Employee.name,
+                models.LeaveBalance.total_days,
+                models.LeaveBalance.days_used,
+            ).outerjoin(
+                models.LeaveBalance,
+                and_(
+                    models.LeaveBalance.employee_id == models.Employee.id,
+                    models.LeaveBalance.year == current_year,
+                ),
+            ).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
-            
-            if not employee:
+
+            if not row:
                 return f"Employee '{employee_name}' not found."
-            
-            # Get current year leave balance
-            current_year = datetime.now().year
-            leave_balance = db.query(models.LeaveBalance).filter(
-                models.LeaveBalance.employee_id == employee.id,
-                models.LeaveBalance.year == current_year
-            ).first()
-            
-            if not leave_balance:
-                return f"No leave balance information found for {employee.name} in {current_year}."
-            
-            remaining_days = leave_balance.total_days - leave_balance.days_used
-            
-            result = f"**Leave Balance for {employee.name} ({current_year}):**\n\n"
-            result += f"📅 **Total Allocated Days:** {leave_balance.total_days}\n"
-            result += f"📊 **Days Used:** {leave_balance.days_used}\n"
+
+            if row.total_days is None:
+                return f"No leave balance information found for {row.name} in {current_year}."
+
+            remaining_days = row.total_days - row.days_used
+
+            result = f"**Leave Balance for {row.name} ({current_year}):**\n\n"
+            result += f"📅 **Total Allocated Days:** {row.total_days}\n"
+            result += f"📊 **Days Used:** {row.days_used}\n"
             result += f"🎯 **Remaining Days:** {remaining_days}\n"
             
             if remaining_days <= 5:
@@ -172,29 +266,31 @@ def check_leave_balance(employee_name: str) -> str:
         except Exception as e:
             return f"An error occurred while checking leave balance: {e}"
 
+# This is a placeholder data set — in a real system it would come from a
+# database or external API. Since it is literal, the response is rendered
+# once at import.
+HOLIDAYS_2025 = [
+    "New Year's Day - January 1, 2025",
+    "Independence Day - February 4, 2025",
+    "Sinhala & Tamil New Year - April 13-14, 2025",
+    "Vesak Day - May 12, 2025",
+    "Christmas Day - December 25, 2025"
+]
+
+_HOLIDAYS_RESPONSE = (
+    "**Company Holidays 2025:**\n\n"
+    + "".join(f"🎉 {holiday}\n" for holiday in HOLIDAYS_2025)
+    + "\n📝 **Note:** Additional religious and cultural holidays may apply based on your location."
+)
+
+
 @tool
 def get_company_holidays() -> str:
     """
     Get information about company holidays and important dates.
     This is a placeholder function - you would typically connect this to a holidays database or API.
     """
-    # This is a placeholder implementation
-    # In a real system, you would fetch this from a database or external API
-    holidays_2025 = [
-        "New Year's Day - January 1, 2025",
-        "Independence Day - February 4, 2025", 
-        "Sinhala & Tamil New Year - April 13-14, 2025",
-        "Vesak Day - May 12, 2025",
-        "Christmas Day - December 25, 2025"
-    ]
-    
-    result = "**Company Holidays 2025:**\n\n"
-    for holiday in holidays_2025:
-        result += f"🎉 {holiday}\n"
-    
-    result += "\n📝 **Note:** Additional religious and cultural holidays may apply based on your location."
-    
-    return result
+    return _HOLIDAYS_RESPONSE
 
 # Export all policy tools
 policy_tools = [
@@ -1,13 +1,19 @@
 import os
+import time
 from datetime import datetime, date, timedelta
 from langchain.tools import tool
-from langchain_openai import ChatOpenAI
 from sqlalchemy import text
-from typing import List, Dict
+from sqlalchemy.orm import joinedload
+from typing import List, Dict, Tuple
 
 from .database import SessionLocal, engine
+from .llm_client import get_chat_model
 from . import models
 
+# Shared generation client; per-call ChatOpenAI construction re-reads the
+# API key and rebuilds httpx state.
+_LLM = get_chat_model(temperature=0.3)
+
 # Predefined skill categories and training programs
 SKILL_CATEGORIES = {
     "technical": ["Python", "JavaScript", "SQL", "Machine Learning", "Cloud Computing", "DevOps", "Data Analysis"],
@@ -23,6 +29,115 @@ TRAINING_PROGRAMS = {
     "Project Management": {"duration": "3 weeks", "type": "Soft Skills", "level": "Intermediate", "provider": "Internal"},
 }
 
+# TRAINING_PROGRAMS is a constant, so each program's display block is
+# rendered once at import; per recommendation only the running number is
+# formatted in.
+_PROGRAM_BLOCKS: Dict[str, str] = {
+    skill: (
+        f"\n\n**{{idx}}. {skill} Training**"
+        f"\n   • Duration: {program['duration']}"
+        f"\n   • Level: {program['level']}"
+        f"\n   • Type: {program['type']}"
+        f"\n   • Provider: {program['provider']}"
+        "\n   • Status: Available"
+    )
+    for skill, program in TRAINING_PROGRAMS.items()
+}
+
+# The generated narratives depend only on low-cardinality inputs (role x
+# department x requirements, or role x target x timeline), so identical
+# requests within a day can reuse the text instead of paying a multi-second
+# GPT-4o call. The prompts deliberately exclude the employee's name — it
+# only appears in the report framing — so one generation serves everyone in
+# the same role.
+_GENERATION_CACHE_TTL = 86400  # seconds
+_assessment_cache: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+_learning_path_cache: Dict[Tuple[str, str, int], Tuple[float, str]] = {}
+
+
+def _generate_assessment(current_role: str, department: str, role_requirements: str) -> str:
+    cache_key = (current_role.lower(), department.lower(), role_requirements.strip().lower())
+    cached = _assessment_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < _GENERATION_CACHE_TTL:
+        return cached[1]
+
+    assessment_prompt = f"""
+    As an HR Learning & Development specialist, assess the skill gaps for an employee with this profile:
+
+    Current Role: {current_role}
+    Department: {department}
+    Role Requirements: {role_requirements if role_requirements else "Standard for " + current_role}
+
+    Provide a skill gap analysis covering:
+    1. Current likely skills (based on role and department)
+    2. Required skills for the role
+    3. Identified gaps
+    4. Priority areas for development
+    5. Recommended training focus
+
+    Format the response in a clear, actionable manner with bullet points.
+    """
+    assessment = _LLM.invoke(assessment_prompt).content
+    _assessment_cache[cache_key] = (time.monotonic(), assessment)
+    return assessment
+
+
+def _generate_learning_path(current_role: str, target_role: str, timeline_months: int) -> str:
+    cache_key = (current_role.lower(), target_role.lower(), timeline_months)
+    cached = _learning_path_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < _GENERATION_CACHE_TTL:
+        return cached[1]
+
+    path_prompt = f"""
+    Create a structured {timeline_months}-month learning path for an employee with this profile:
+
+    Current Role: {current_role}
+    Target Role/Skills: {target_role}
+    Timeline: {timeline_months} months
+
+    Structure the learning path with:
+    1. Monthly milestones
+    2. Specific skills/courses for each month
+    3. Practical projects or assignments
+    4. Assessment checkpoints
+    5. Resources needed
+
+    Make it progressive and practical.
+    """
+    learning_path = _LLM.invoke(path_prompt).content
+    _learning_path_cache[cache_key] = (time.monotonic(), learning_path)
+    return learning_path
+
+
+# Training report roster in one round trip: the derived aggregate only
+# scans this year's 'Present' rows (matching the partial index) instead of
+# CASE-filtering the whole attendance join, the window function carries the
+# matched-employee count past the LIMIT, and fetching 11 rows detects
+# "more than 10" without pulling every employee.
+TRAINING_REPORT_SQL = text("""
+    SELECT
+        e.name,
+        e.role,
+        d.name as department_name,
+        COALESCE(a.attendance_days, 0) as attendance_days,
+        COUNT(*) OVER () AS total_matched
+    FROM employees e
+    LEFT JOIN departments d ON e.department_id = d.id
+    LEFT JOIN (
+        SELECT employee_id, COUNT(DISTINCT attendance_date) AS attendance_days
+        FROM attendances
+        WHERE status = 'Present'
+        AND attendance_date >= date_trunc('year', CURRENT_DATE)
+        GROUP BY employee_id
+    ) a ON a.employee_id = e.id
+    WHERE e.is_active = true
+    AND (CAST(:emp_id AS INTEGER) IS NULL OR e.id = :emp_id)
+    AND (CAST(:dept_id AS INTEGER) IS NULL OR e.department_id = :dept_id)
+    ORDER BY e.name
+    LIMIT 11
+""")
+
+
 @tool
 def assess_skill_gaps(employee_name: str, role_requirements: str = "") -> str:
     """
@@ -33,39 +148,22 @@ def assess_skill_gaps(employee_name: str, role_requirements: str = "") -> str:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Find employee; the assessment reads the department relationship,
+            # so eager-load it rather than lazy-loading in a second query.
+            employee = db.query(models.Employee).options(
+                joinedload(models.Employee.department)
+            ).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
-            
+
             if not employee:
                 return f"Employee '{employee_name}' not found."
-            
+
             current_role = employee.role or "Not specified"
             department = employee.department.name if employee.department else "Not assigned"
-            
-            # Generate skill assessment using AI
-            ai_model = ChatOpenAI(model="gpt-4o", temperature=0.3)
-            
-            assessment_prompt = f"""
-            As an HR Learning & Development specialist, assess the skill gaps for the following employee:
-            
-            Employee: {employee.name}
-            Current Role: {current_role}
-            Department: {department}
-            Role Requirements: {role_requirements if role_requirements else "Standard for " + current_role}
-            
-            Provide a skill gap analysis covering:
-            1. Current likely skills (based on role and department)
-            2. Required skills for the role
-            3. Identified gaps
-            4. Priority areas for development
-            5. Recommended training focus
-            
-            Format the response in a clear, actionable manner with bullet points.
-            """
-            
-            assessment = ai_model.invoke(assessment_prompt).content
+
+            # Generate skill assessment using AI (cached per role profile)
+            assessment = _generate_assessment(current_role, department, role_requirements)
             
             return f"""🎯 **Skill Gap Analysis - {employee.name}**
 
@@ -97,8 +195,8 @@ def recommend_training_programs(employee_name: str, skill_focus: str, urgency: s
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is rendered, so skip full-entity hydration
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -111,40 +209,25 @@ def recommend_training_programs(employee_name: str, skill_focus: str, urgency: s
             if not focus_skills:
                 focus_skills = ["Communication", "Leadership", "Problem Solving"]  # Default recommendations
             
-            recommendations = []
-            for skill in focus_skills[:5]:  # Limit to top 5 recommendations
-                if skill in TRAINING_PROGRAMS:
-                    program = TRAINING_PROGRAMS[skill]
-                    recommendations.append({
-                        "skill": skill,
-                        "duration": program["duration"],
-                        "level": program["level"],
-                        "type": program["type"],
-                        "provider": program["provider"]
-                    })
-            
+            # Limit to top 5 recommendations
+            recommendations = [skill for skill in focus_skills[:5] if skill in _PROGRAM_BLOCKS]
+
+
             # Priority indicators
             priority_emoji = {"high": "🔥", "medium": "⚡", "low": "📚"}[urgency.lower()]
             
-            result = f"""{priority_emoji} **Training Recommendations - {employee.name}**
+            parts = [f"""{priority_emoji} **Training Recommendations - {employee.name}**
 
 **Focus Area:** {skill_focus.replace('_', ' ').title()}
 **Priority:** {urgency.title()}
 **Generated:** {datetime.now().strftime('%Y-%m-%d')}
 
-**📚 Recommended Programs:**"""
-            
-            for i, rec in enumerate(recommendations, 1):
-                result += f"""
+**📚 Recommended Programs:**"""]
 
-**{i}. {rec['skill']} Training**
-   • Duration: {rec['duration']}
-   • Level: {rec['level']}
-   • Type: {rec['type']}
-   • Provider: {rec['provider']}
-   • Status: Available"""
-            
-            result += f"""
+            for i, skill in enumerate(recommendations, 1):
+                parts.append(_PROGRAM_BLOCKS[skill].format(idx=i))
+
+            parts.append("""
 
 **🎯 Implementation Plan:**
 1. Enroll in top 2-3 priority programs
@@ -153,9 +236,9 @@ def recommend_training_programs(employee_name: str, skill_focus: str, urgency: s
 4. Set completion milestones
 5. Plan progress assessments
 
-*Use 'create_learning_path' to build a structured development plan.*"""
-            
-            return result
+*Use 'create_learning_path' to build a structured development plan.*""")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred while generating training recommendations: {e}"
@@ -171,8 +254,8 @@ def create_learning_path(employee_name: str, target_role: str, timeline_months:
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Just the two columns the path needs — no entity hydration
+            employee = db.query(models.Employee.name, models.Employee.role).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -180,29 +263,9 @@ def create_learning_path(employee_name: str, target_role: str, timeline_months:
                 return f"Employee '{employee_name}' not found."
             
             current_role = employee.role or "Current Role"
-            
-            # Generate learning path using AI
-            ai_model = ChatOpenAI(model="gpt-4o", temperature=0.3)
-            
-            path_prompt = f"""
-            Create a structured {timeline_months}-month learning path for:
-            
-            Employee: {employee.name}
-            Current Role: {current_role}
-            Target Role/Skills: {target_role}
-            Timeline: {timeline_months} months
-            
-            Structure the learning path with:
-            1. Monthly milestones
-            2. Specific skills/courses for each month
-            3. Practical projects or assignments
-            4. Assessment checkpoints
-            5. Resources needed
-            
-            Make it progressive and practical.
-            """
-            
-            learning_path = ai_model.invoke(path_prompt).content
+
+            # Generate learning path using AI (cached per role/target/timeline)
+            learning_path = _generate_learning_path(current_role, target_role, timeline_months)
             
             # Calculate key dates
             start_date = datetime.now().date()
@@ -250,8 +313,8 @@ def track_training_completion(employee_name: str, program_name: str, completion_
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Only the name is rendered, so skip full-entity hydration
+            employee = db.query(models.Employee.name).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
             
@@ -261,7 +324,7 @@ def track_training_completion(employee_name: str, program_name: str, completion_
             # Validate completion date if provided
             if completion_date:
                 try:
-                    comp_date = datetime.strptime(completion_date, "%Y-%m-%d").date()
+                    comp_date = date.fromisoformat(completion_date)
                 except ValueError:
                     return "Invalid completion date format. Please use YYYY-MM-DD format."
             else:
@@ -334,67 +397,46 @@ def generate_training_report(employee_name: str = "", department: str = "", peri
     """
     with SessionLocal() as db:
         try:
-            # Build query based on filters
-            query_conditions = ["e.is_active = true"]
-            params = {}
-            
+            # Resolve scope filters
+            params = {'emp_id': None, 'dept_id': None}
+
             if employee_name:
                 # Find specific employee
-                employee = db.query(models.Employee).filter(
+                employee = db.query(models.Employee.id, models.Employee.name).filter(
                     models.Employee.name.ilike(f"%{employee_name}%")
                 ).first()
-                
+
                 if not employee:
                     return f"Employee '{employee_name}' not found."
-                
-                query_conditions.append("e.id = :emp_id")
+
                 params['emp_id'] = employee.id
                 report_scope = f"Employee: {employee.name}"
-                
+
             elif department:
                 # Find department
                 dept = db.query(models.Department).filter(
                     models.Department.name.ilike(f"%{department}%")
                 ).first()
-                
+
                 if not dept:
                     return f"Department '{department}' not found."
-                
-                query_conditions.append("e.department_id = :dept_id")
+
                 params['dept_id'] = dept.id
                 report_scope = f"Department: {dept.name}"
-                
+
             else:
                 report_scope = "Company-wide"
-            
-            # Get employee data
-            where_clause = " AND ".join(query_conditions)
-            employee_query = f"""
-            SELECT 
-                e.name,
-                e.role,
-                d.name as department_name,
-                COUNT(DISTINCT CASE WHEN a.status = 'Present' THEN a.attendance_date END) as attendance_days
-            FROM employees e
-            LEFT JOIN departments d ON e.department_id = d.id
-            LEFT JOIN attendances a ON e.id = a.employee_id 
-                AND EXTRACT(YEAR FROM a.attendance_date) = EXTRACT(YEAR FROM CURRENT_DATE)
-            WHERE {where_clause}
-            GROUP BY e.id, e.name, e.role, d.name
-            ORDER BY e.name
-            """
-            
-            result = db.execute(text(employee_query), params)
-            employees_data = result.fetchall()
-            
+
+            employees_data = db.execute(TRAINING_REPORT_SQL, params).mappings().all()
+
             if not employees_data:
                 return f"No employees found for the specified criteria."
-            
+
             # Generate comprehensive report
-            total_employees = len(employees_data)
+            total_employees = employees_data[0]['total_matched']
             current_year = datetime.now().year
             
-            report = f"""📊 **Training & Development Report**
+            parts = [f"""📊 **Training & Development Report**
 
 **Scope:** {report_scope}
 **Period:** {period.replace('_', ' ').title()} ({current_year})
@@ -412,22 +454,21 @@ def generate_training_report(employee_name: str = "", department: str = "", peri
 • Emerging Training Needs: AI/ML, Remote work management
 • Popular Programs: To be tracked with enhanced system
 
-**👥 Employee Training Summary:**"""
-            
+**👥 Employee Training Summary:**"""]
+
             for emp_data in employees_data[:10]:  # Limit to first 10 employees
-                name, role, dept_name, attendance = emp_data
-                report += f"""
-
-**{name}**
-• Role: {role or 'Not specified'}
-• Department: {dept_name or 'Not assigned'}  
-• Attendance Days: {attendance or 0}
-• Training Status: Tracking system in development"""
-            
-            if len(employees_data) > 10:
-                report += f"\n\n*... and {len(employees_data) - 10} more employees*"
-            
-            report += f"""
+                parts.append(f"""
+
+**{emp_data['name']}**
+• Role: {emp_data['role'] or 'Not specified'}
+• Department: {emp_data['department_name'] or 'Not assigned'}
+• Attendance Days: {emp_data['attendance_days']}
+• Training Status: Tracking system in development""")
+
+            if total_employees > 10:
+                parts.append(f"\n\n*... and {total_employees - 10} more employees*")
+
+            parts.append("""
 
 **🚀 Recommendations:**
 1. Implement training database models for detailed tracking
@@ -440,9 +481,9 @@ def generate_training_report(employee_name: str = "", department: str = "", peri
 • Complete training system database implementation
 • Set up training provider integrations
 • Launch employee self-assessment tools
-• Establish training ROI measurement metrics"""
-            
-            return report
+• Establish training ROI measurement metrics""")
+
+            return "".join(parts)
             
         except Exception as e:
             return f"An error occurred while generating the training report: {e}"
@@ -459,22 +500,24 @@ def schedule_skills_assessment(employee_name: str, assessment_type: str, assessm
     """
     with SessionLocal() as db:
         try:
-            # Find employee
-            employee = db.query(models.Employee).filter(
+            # Find employee with their department (read below) in one query
+            employee = db.query(models.Employee).options(
+                joinedload(models.Employee.department)
+            ).filter(
                 models.Employee.name.ilike(f"%{employee_name}%")
             ).first()
-            
+
             if not employee:
                 return f"Employee '{employee_name}' not found."
-            
+
             # Validate date format
             try:
-                assessment_datetime = datetime.strptime(assessment_date, "%Y-%m-%d")
+                assessment_day = date.fromisoformat(assessment_date)
             except ValueError:
                 return "Invalid date format. Please use YYYY-MM-DD format."
             
             # Check if date is in the future
-            if assessment_datetime.date() <= date.today():
+            if assessment_day <= date.today():
                 return "Assessment date should be in the future."
             
             return f"""📋 **Skills Assessment Scheduled**
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import List, Optional
+
+# The OpenAI embeddings endpoint accepts many inputs per request, so N
+# concurrent single-text calls can be coalesced into one HTTP round trip.
+# Tools run synchronously on LangGraph's worker threads, so the coalescer is
+# thread-based: the first caller in a window becomes the leader, waits a few
+# milliseconds for stragglers, then embeds the whole batch and hands each
+# waiter its vector. Chat completions get no such coalescer — the chat API
+# has no multi-prompt request, so "batching" there is just parallel HTTP
+# calls, which the agents already do via parallel tool execution.
+
+
+class _PendingEmbed:
+    __slots__ = ("text", "event", "result", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.event = threading.Event()
+        self.result: Optional[List[float]] = None
+        self.error: Optional[Exception] = None
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embed requests into single embed_documents calls."""
+
+    def __init__(self, embeddings, max_batch: int = 16, max_wait: float = 0.01):
+        self._embeddings = embeddings
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending: List[_PendingEmbed] = []
+        self._has_leader = False
+
+    def embed(self, text: str) -> List[float]:
+        """Embed one text, sharing an API call with any concurrent callers."""
+        item = _PendingEmbed(text)
+        with self._lock:
+            self._pending.append(item)
+            is_leader = not self._has_leader
+            if is_leader:
+                self._has_leader = True
+
+        if not is_leader:
+            item.event.wait()
+            if item.error is not None:
+                raise item.error
+            return item.result
+
+        # Leader: give followers a short window to join, unless the batch
+        # is already full.
+        deadline = time.monotonic() + self._max_wait
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self._pending) >= self._max_batch:
+                    break
+            time.sleep(0.001)
+
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+            self._has_leader = False
+
+        try:
+            vectors = self._embeddings.embed_documents([p.text for p in batch])
+            for pending, vector in zip(batch, vectors):
+                pending.result = vector
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.event.set()
+
+        if item.error is not None:
+            raise item.error
+        return item.result
@@ -0,0 +1,46 @@
+from functools import lru_cache
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from .llm_batcher import EmbeddingBatcher
+
+# Every ChatOpenAI instance owns its own httpx client and connection pool.
+# Constructing one per module (or per call) duplicates TLS handshakes and
+# prevents connection reuse against the OpenAI endpoint, so all modules
+# should obtain their client from here.
+
+# One transport pool for the whole process, shared by every ChatOpenAI
+# configuration. HTTP/2 multiplexes concurrent requests (several tool
+# calls in one agent turn) over a single kept-alive connection instead of
+# opening a socket per in-flight call.
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=16)
+_http_client = httpx.Client(http2=True, limits=_HTTP_LIMITS)
+_http_async_client = httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS)
+
+
+@lru_cache(maxsize=None)
+def get_chat_model(model: str = "gpt-4o", temperature: float = 0.0) -> ChatOpenAI:
+    """Return the process-wide shared ChatOpenAI client for a configuration."""
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        http_client=_http_client,
+        http_async_client=_http_async_client,
+    )
+
+
+# Default client used by the agents and the supervisor.
+shared_llm = get_chat_model()
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    """Return the process-wide shared embeddings client."""
+    return OpenAIEmbeddings(model="text-embedding-3-small")
+
+
+@lru_cache(maxsize=1)
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Return the shared batcher that coalesces concurrent embed calls."""
+    return EmbeddingBatcher(get_embeddings())
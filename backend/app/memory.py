@@ -1,20 +1,31 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Index, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
-from .database import Base, engine
+from .database import Base
 
 
 class ConversationMemory(Base):
     __tablename__ = "conversation_memories"
+    # "Latest memory for a session" is the hot lookup on every chat turn;
+    # the created_at index backs the "recent sessions" listing's ORDER BY.
+    __table_args__ = (
+        Index("ix_conv_mem_session_updated", "session_id", "updated_at"),
+        Index("ix_conv_mem_created", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
-    session_id = Column(String(255), nullable=False, index=True)
+    # Unique: one memory row per session, which lets writers upsert with
+    # ON CONFLICT (session_id) instead of select-then-insert.
+    session_id = Column(String(255), nullable=False, unique=True, index=True)
     user_id = Column(String(255), nullable=True, index=True)
     conversation_summary = Column(Text, nullable=True)
-    key_points = Column(JSON, nullable=True)
-    user_preferences = Column(JSON, nullable=True)
-    context_window = Column(JSON, nullable=True)
+    # JSONB rather than JSON: stored pre-parsed, so reads skip re-parsing
+    # and keys are GIN-indexable if ever needed.
+    key_points = Column(JSONB, nullable=True)
+    user_preferences = Column(JSONB, nullable=True)
+    context_window = Column(JSONB, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -27,13 +38,18 @@ class ConversationMemory(Base):
 
 class MemoryMessage(Base):
     __tablename__ = "memory_messages"
+    # History loads filter by memory and order by time; without this the
+    # read is a seq scan plus sort on every turn.
+    __table_args__ = (
+        Index("ix_memory_messages_memory_ts", "memory_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True)
     memory_id = Column(Integer, ForeignKey("conversation_memories.id"))
     role = Column(String(50), nullable=False)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    message_metadata = Column(JSON, nullable=True)
+    message_metadata = Column(JSONB, nullable=True)
 
     memory = relationship("ConversationMemory", back_populates="messages")
 
@@ -45,14 +61,9 @@ class UserProfile(Base):
     user_id = Column(String(255), nullable=False, unique=True, index=True)
     language_preference = Column(String(10), default="en")
     communication_style = Column(String(50), default="formal")
-    hr_topics_interest = Column(JSON, nullable=True)
+    hr_topics_interest = Column(JSONB, nullable=True)
     department = Column(String(255), nullable=True)
     role = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-
-# Ensure tables are created on startup if they do not exist
-Base.metadata.create_all(bind=engine)
-
-
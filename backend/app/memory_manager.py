@@ -1,109 +1,268 @@
-from typing import Dict, List, Optional, Any
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, text
 
 from .database import SessionLocal
 from .memory import ConversationMemory, MemoryMessage
+from .redis_cache import invalidate_session_messages
+
+# Cleanup works in bounded batches: pick a slice of expired memory ids,
+# bulk-delete their messages and then the memories, and commit per batch
+# so row locks and WAL volume stay small no matter how much has accrued.
+_CLEANUP_BATCH = 1000
+
+_CLEANUP_PICK_SQL = text("""
+    SELECT id FROM conversation_memories
+    WHERE updated_at IS NOT NULL AND updated_at < :cutoff
+    ORDER BY id
+    LIMIT :batch
+""")
+
+_CLEANUP_MESSAGES_SQL = text(
+    "DELETE FROM memory_messages WHERE memory_id = ANY(:ids)"
+)
+
+_CLEANUP_MEMORIES_SQL = text(
+    "DELETE FROM conversation_memories WHERE id = ANY(:ids)"
+)
+
+# add_message used to be a select, up to three inserts/updates and two or
+# three commits. The whole turn is now one transaction: upsert the memory
+# row (unique session_id), insert the message, and rebuild the context
+# window server-side with jsonb_agg — one commit, one fsync.
+_UPSERT_MEMORY_SQL = text("""
+    INSERT INTO conversation_memories
+        (session_id, user_id, key_points, user_preferences, context_window, updated_at)
+    VALUES (:sid, :uid, '[]'::jsonb, '{}'::jsonb, '[]'::jsonb, now())
+    ON CONFLICT (session_id) DO UPDATE SET updated_at = now()
+    RETURNING id
+""")
+
+_INSERT_MESSAGE_SQL = text("""
+    INSERT INTO memory_messages (memory_id, role, content, message_metadata)
+    VALUES (:mid, :role, :content, CAST(:meta AS jsonb))
+""")
+
+_REFRESH_CONTEXT_SQL = text("""
+    UPDATE conversation_memories SET context_window = (
+        SELECT COALESCE(
+            jsonb_agg(jsonb_build_object('role', role, 'content', content) ORDER BY ts),
+            '[]'::jsonb
+        )
+        FROM (
+            SELECT role, content, timestamp AS ts
+            FROM memory_messages
+            WHERE memory_id = :mid
+            ORDER BY timestamp DESC
+            LIMIT :n
+        ) recent
+    )
+    WHERE id = :mid
+""")
+
+
+# A chat session hits the manager on every turn, so the session_id ->
+# memory_id mapping (stable for a session's lifetime) and recently built
+# context lists are cached in-process. Writes invalidate the session's
+# context entries; cleanup drops everything.
+_ID_CACHE_TTL = 300  # seconds
+_ID_CACHE_MAX = 10_000
+_CONTEXT_CACHE_TTL = 300  # seconds
+_CONTEXT_CACHE_MAX = 1_000
 
 
 class MemoryManager:
     def __init__(self, max_context_length: int = 10):
         self.max_context_length = max_context_length
+        self._id_cache: Dict[str, Tuple[float, int]] = {}
+        self._context_cache: Dict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]] = {}
+        # Formatted snippet strings, keyed like the raw context but per
+        # (n, max_chars); invalidated together with it on writes.
+        self._snippet_cache: Dict[Tuple[str, int, int], Tuple[float, str]] = {}
+        # The manager is called from to_thread workers and the FastAPI
+        # threadpool concurrently. Single-key get() is atomic under the
+        # GIL, but anything that iterates or does a multi-step mutation
+        # (clear-when-full, invalidation sweeps) must hold this lock or a
+        # concurrent store raises "dictionary changed size during
+        # iteration".
+        self._lock = threading.Lock()
 
-    def _get_or_create_memory(self, db: Session, session_id: str, user_id: Optional[str] = None) -> ConversationMemory:
-        memory: Optional[ConversationMemory] = (
-            db.query(ConversationMemory)
+    def _cached_memory_id(self, db, session_id: str) -> Optional[int]:
+        """Resolve a session's memory id, avoiding the SELECT when warm."""
+        hit = self._id_cache.get(session_id)
+        if hit and time.monotonic() - hit[0] < _ID_CACHE_TTL:
+            return hit[1]
+        memory_id = (
+            db.query(ConversationMemory.id)
             .filter(ConversationMemory.session_id == session_id)
-            .first()
-        )
-        if memory:
-            return memory
-
-        memory = ConversationMemory(
-            session_id=session_id,
-            user_id=user_id,
-            key_points=[],
-            user_preferences={},
-            context_window=[],
+            .scalar()
         )
-        db.add(memory)
-        db.commit()
-        db.refresh(memory)
-        return memory
+        if memory_id is not None:
+            self._remember_id(session_id, memory_id)
+        return memory_id
+
+    def _remember_id(self, session_id: str, memory_id: int) -> None:
+        with self._lock:
+            if len(self._id_cache) >= _ID_CACHE_MAX:
+                self._id_cache.clear()
+            self._id_cache[session_id] = (time.monotonic(), memory_id)
+
+    def _drop_session_contexts(self, session_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._context_cache if k[0] == session_id]:
+                self._context_cache.pop(key, None)
+            for key in [k for k in self._snippet_cache if k[0] == session_id]:
+                self._snippet_cache.pop(key, None)
+
+    def invalidate_session(self, session_id: str) -> None:
+        """Drop cached state for one session (call after deleting it)."""
+        with self._lock:
+            self._id_cache.pop(session_id, None)
+        self._drop_session_contexts(session_id)
+
+    def invalidate_all(self) -> None:
+        """Drop all cached session state (call after bulk deletes)."""
+        with self._lock:
+            self._id_cache.clear()
+            self._context_cache.clear()
+            self._snippet_cache.clear()
 
     def add_message(self, session_id: str, role: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
         with SessionLocal() as db:
-            memory = self._get_or_create_memory(db, session_id)
-            message = MemoryMessage(
-                memory_id=memory.id,
-                role=role,
-                content=content,
-                message_metadata=metadata or {},
+            memory_id = db.execute(
+                _UPSERT_MEMORY_SQL, {"sid": session_id, "uid": None}
+            ).scalar()
+            db.execute(
+                _INSERT_MESSAGE_SQL,
+                {
+                    "mid": memory_id,
+                    "role": role,
+                    "content": content,
+                    "meta": json.dumps(metadata or {}),
+                },
+            )
+            db.execute(
+                _REFRESH_CONTEXT_SQL,
+                {"mid": memory_id, "n": self.max_context_length},
             )
-            db.add(message)
             db.commit()
-            self._refresh_context_window(db, memory.id)
+        self._remember_id(session_id, memory_id)
+        # The session's materialized contexts/snippets are stale now, as is
+        # any Redis-cached copy of its message history.
+        self._drop_session_contexts(session_id)
+        invalidate_session_messages(session_id)
 
     def get_context(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        limit_val = limit or self.max_context_length
+        cache_key = (session_id, limit_val)
+        hit = self._context_cache.get(cache_key)
+        if hit and time.monotonic() - hit[0] < _CONTEXT_CACHE_TTL:
+            return hit[1]
+
         with SessionLocal() as db:
-            memory: Optional[ConversationMemory] = (
-                db.query(ConversationMemory)
-                .filter(ConversationMemory.session_id == session_id)
-                .first()
-            )
-            if not memory:
+            memory_id = self._cached_memory_id(db, session_id)
+            if memory_id is None:
                 return []
 
-            limit_val = limit or self.max_context_length
-            recent_messages = (
-                db.query(MemoryMessage)
-                .filter(MemoryMessage.memory_id == memory.id)
+            # Tuples, not ORM objects: three columns per row with the
+            # timestamp already ISO-formatted by Postgres, skipping entity
+            # hydration and Python datetime round-trips.
+            rows = db.execute(
+                select(
+                    MemoryMessage.role,
+                    MemoryMessage.content,
+                    func.to_char(MemoryMessage.timestamp, 'YYYY-MM-DD"T"HH24:MI:SS'),
+                )
+                .where(MemoryMessage.memory_id == memory_id)
                 .order_by(MemoryMessage.timestamp.desc())
                 .limit(limit_val)
+            ).all()
+
+            context: List[Dict[str, Any]] = [
+                {"role": role, "content": content, "timestamp": ts or ""}
+                for role, content, ts in reversed(rows)
+            ]
+            with self._lock:
+                if len(self._context_cache) >= _CONTEXT_CACHE_MAX:
+                    self._context_cache.clear()
+                self._context_cache[cache_key] = (time.monotonic(), context)
+            return context
+
+    def get_recent(self, session_id: str, n: int = 3, max_chars: int = 120) -> List[Tuple[str, str]]:
+        """Return the last n (role, content) pairs for a session, oldest first.
+
+        The row limit and content truncation are pushed into SQL so at most
+        n pre-truncated rows ever cross the database boundary.
+        """
+        with SessionLocal() as db:
+            memory_id = self._cached_memory_id(db, session_id)
+            if memory_id is None:
+                return []
+
+            rows = (
+                db.query(MemoryMessage.role, func.substr(MemoryMessage.content, 1, max_chars))
+                .filter(MemoryMessage.memory_id == memory_id)
+                .order_by(MemoryMessage.timestamp.desc())
+                .limit(n)
                 .all()
             )
+            return [(role, content) for role, content in reversed(rows)]
 
-            context: List[Dict[str, Any]] = []
-            for m in reversed(recent_messages):
-                context.append(
-                    {
-                        "role": m.role,
-                        "content": m.content,
-                        "timestamp": m.timestamp.isoformat() if m.timestamp else "",
-                    }
-                )
-            return context
+    def get_context_snippet(self, session_id: str, n: int = 3, max_chars: int = 120) -> str:
+        """Build the "recent conversation" block both chat endpoints prepend.
+
+        The snippet is deterministic — role and truncated content only, no
+        timestamps — and carries a short content-hash version header, so
+        its bytes are identical across turns where the context has not
+        changed and provider-side prompt caches can keep hitting.
+        """
+        cache_key = (session_id, n, max_chars)
+        hit = self._snippet_cache.get(cache_key)
+        if hit and time.monotonic() - hit[0] < _CONTEXT_CACHE_TTL:
+            return hit[1]
+
+        ctx = self.get_recent(session_id, n=n, max_chars=max_chars)
+        if not ctx:
+            return ""
+        body = "\n".join(f"- {role}: {content}..." for role, content in ctx)
+        version = hashlib.blake2b(body.encode(), digest_size=4).hexdigest()
+        snippet = f"<context version={version}>\nRecent conversation context:\n{body}"
+        with self._lock:
+            if len(self._snippet_cache) >= _CONTEXT_CACHE_MAX:
+                self._snippet_cache.clear()
+            self._snippet_cache[cache_key] = (time.monotonic(), snippet)
+        return snippet
 
     def cleanup(self, days_old: int = 30) -> int:
         cutoff = datetime.now() - timedelta(days=days_old)
+        count = 0
         with SessionLocal() as db:
-            old_memories = (
-                db.query(ConversationMemory)
-                .filter(ConversationMemory.updated_at != None)
-                .filter(ConversationMemory.updated_at < cutoff)
-                .all()
-            )
-            count = len(old_memories)
-            for mem in old_memories:
-                db.delete(mem)
-            db.commit()
-            return count
-
-    def _refresh_context_window(self, db: Session, memory_id: int) -> None:
-        recent_messages = (
-            db.query(MemoryMessage)
-            .filter(MemoryMessage.memory_id == memory_id)
-            .order_by(MemoryMessage.timestamp.desc())
-            .limit(self.max_context_length)
-            .all()
-        )
-        ctx = [{"role": m.role, "content": m.content} for m in reversed(recent_messages)]
-        (
-            db.query(ConversationMemory)
-            .filter(ConversationMemory.id == memory_id)
-            .update({"context_window": ctx})
-        )
-        db.commit()
+            while True:
+                ids = [
+                    row[0]
+                    for row in db.execute(
+                        _CLEANUP_PICK_SQL,
+                        {"cutoff": cutoff, "batch": _CLEANUP_BATCH},
+                    )
+                ]
+                if not ids:
+                    break
+                db.execute(_CLEANUP_MESSAGES_SQL, {"ids": ids})
+                db.execute(_CLEANUP_MEMORIES_SQL, {"ids": ids})
+                db.commit()
+                count += len(ids)
+        if count:
+            # Cached ids/contexts may point at deleted rows.
+            self.invalidate_all()
+        return count
 
 
+# Shared process-wide instance. All request paths should use this rather than
+# constructing their own manager, so session state and any caches it grows
+# live in one place backed by the pooled engine.
+memory_manager = MemoryManager()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Text, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from .database import Base
 from pgvector.sqlalchemy import Vector
@@ -56,6 +56,9 @@ class HRPolicy(Base):
 
 class LeaveRequest(Base):
     __tablename__ = "leave_requests"
+    # One request per employee per date; lets request_leave insert with
+    # ON CONFLICT instead of SELECT-then-INSERT.
+    __table_args__ = (UniqueConstraint('employee_id', 'leave_date', name='uq_leave_emp_date'),)
     id = Column(Integer, primary_key=True)
     employee_id = Column(Integer, ForeignKey("employees.id"))
     leave_date = Column(Date, nullable=False)
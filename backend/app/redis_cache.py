@@ -0,0 +1,48 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import redis
+except ImportError:  # Redis support is optional; endpoints fall back to Postgres.
+    redis = None
+
+# Cached session-message payloads live a short time; writes invalidate
+# them explicitly, so the TTL only bounds staleness if an invalidation is
+# ever missed (e.g. another process writing the same session).
+SESSION_MESSAGES_TTL = 60  # seconds
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Return the shared Redis client, or None when not configured.
+
+    Enabled by setting REDIS_URL; without it (or without the redis
+    package installed) every caller silently skips the cache layer.
+    """
+    url = os.getenv("REDIS_URL")
+    if not url or redis is None:
+        return None
+    return redis.Redis.from_url(url)
+
+
+def session_messages_key(session_id: str) -> str:
+    return f"sess:{session_id}:msgs"
+
+
+def invalidate_session_messages(session_id: Optional[str] = None) -> None:
+    """Drop cached message payloads for one session, or all when None."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if session_id is not None:
+            client.delete(session_messages_key(session_id))
+        else:
+            keys = list(client.scan_iter("sess:*:msgs"))
+            if keys:
+                client.delete(*keys)
+    except Exception:
+        # Cache invalidation must never take a request down with it; a
+        # missed delete is bounded by the TTL.
+        pass
@@ -0,0 +1,40 @@
+import time
+from typing import List, Optional, Tuple
+
+
+class SemanticCache:
+    """Small in-process cache keyed by query embeddings.
+
+    Near-duplicate phrasings of the same question ("list IT employees",
+    "list employees of IT dept") embed close together, so a lookup that
+    clears the similarity threshold can reuse the stored answer without
+    re-running the LLM or the search behind it. Entries expire on a TTL
+    and the whole cache is dropped when full, matching the other
+    in-process caches in this app.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 128, threshold: float = 0.95):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: List[Tuple[float, List[float], str]] = []  # (ts, embedding, value)
+
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Return the cached value for the closest fresh entry, or None."""
+        now = time.monotonic()
+        # OpenAI embeddings are unit-normalized, so the dot product is the
+        # cosine similarity.
+        for ts, cached_vec, value in self._entries:
+            if now - ts >= self.ttl:
+                continue
+            if sum(a * b for a, b in zip(embedding, cached_vec)) >= self.threshold:
+                return value
+        return None
+
+    def store(self, embedding: List[float], value: str) -> None:
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries.append((time.monotonic(), embedding, value))
+
+    def clear(self) -> None:
+        self._entries.clear()
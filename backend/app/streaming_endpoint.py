@@ -4,33 +4,50 @@ from langchain_core.messages import HumanMessage
 from typing import AsyncGenerator, Any, Dict, List, Optional
 import json
 import asyncio
-from datetime import datetime
+import time
 
-from .agents import hr_agent_system
-from .memory_manager import MemoryManager
+import orjson
 
-async def stream_hr_response(query: str, session_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+from . import background
+from .agents import get_hr_agent_system
+from .memory_manager import memory_manager
+
+memory = memory_manager
+
+# Token frames are the hot loop — one per streamed token — so their SSE
+# wrapper is pre-encoded and only the token itself is serialized, with
+# orjson emitting bytes directly. The other frame types fire a handful of
+# times per request and keep the plain json.dumps form.
+_TOKEN_PREFIX = b'data: {"type": "token", "content": '
+_TOKEN_SUFFIX = b"}\n\n"
+
+async def stream_hr_response(query: str, session_id: Optional[str] = None) -> AsyncGenerator[Any, None]:
     """
     Streams HR agent responses in real-time using LangGraph's astream_events for true streaming
     """
-    memory = MemoryManager()
     sid = session_id or "default"
-    
+    hr_agent_system = get_hr_agent_system()
+    # One clock read per request; both metadata writes tag the same turn.
+    # The authoritative row timestamp is set server-side by func.now().
+    request_ts = time.time_ns()
+
     try:
-        # Store user message
-        memory.add_message(sid, "user", query, {"ts": datetime.now().isoformat()})
-        
-        # Prepare context
-        ctx = memory.get_context(sid)
-        context_snippet = ""
-        if ctx:
-            context_snippet = "Recent conversation context:\n" + "\n".join(
-                [f"- {m.get('role')}: {m.get('content')[:120]}..." for m in ctx[-3:]]
-            )
+        # Store user message; sync DB I/O runs off the event loop so other
+        # streams keep flowing while this request waits on Postgres.
+        await asyncio.to_thread(
+            memory.add_message, sid, "user", query, {"ts": request_ts}
+        )
+
+        # Deterministic, hash-versioned context block shared with the
+        # non-streaming endpoint; limit and truncation happen in SQL so
+        # only three short rows are ever fetched.
+        context_snippet = await asyncio.to_thread(memory.get_context_snippet, sid)
         
+        # Keep the dynamic memory snippet at the tail of the message so the
+        # static system-prompt prefix stays cacheable on the provider side.
         user_content = query
         if context_snippet:
-            user_content = f"{context_snippet}\n\nCurrent question: {query}"
+            user_content = f"Current question: {query}\n\n{context_snippet}"
         
         # Configure the agent system for streaming
         initial_state = {
@@ -42,6 +59,9 @@ async def stream_hr_response(query: str, session_id: Optional[str] = None) -> As
         
         # Variables to accumulate the final response for storage
         final_response_parts = []
+        # Final message content captured from chain-end events, used when no
+        # tokens streamed (tool-only turns) without re-running the graph.
+        final_state_response = ""
         current_tool = None
         
         try:
@@ -61,7 +81,7 @@ async def stream_hr_response(query: str, session_id: Optional[str] = None) -> As
                     if chunk and hasattr(chunk, 'content') and chunk.content:
                         token = chunk.content
                         final_response_parts.append(token)
-                        yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+                        yield _TOKEN_PREFIX + orjson.dumps(token) + _TOKEN_SUFFIX
                 
                 elif event_type == "on_tool_start":
                     # A tool is being called
@@ -95,25 +115,36 @@ async def stream_hr_response(query: str, session_id: Optional[str] = None) -> As
                 elif event_type == "on_chain_end":
                     # Agent or chain has finished
                     chain_name = event.get("name", "")
+                    # Remember the newest final message seen in any chain
+                    # output; the last one belongs to the top-level graph.
+                    output = event.get("data", {}).get("output")
+                    if isinstance(output, dict) and output.get("messages"):
+                        content = getattr(output["messages"][-1], "content", "")
+                        if content:
+                            final_state_response = content
                     if "agent" in chain_name.lower():
                         yield f"data: {json.dumps({'type': 'agent_end', 'agent': chain_name, 'message': f'✅ {chain_name} completed'})}\n\n"
-            
+
             # Compile final response and store it
             final_response = "".join(final_response_parts)
-            
-            # If no tokens were collected (which might happen with some tool-only responses),
-            # try to get the final message from a direct invocation result
+
+            # If no tokens were collected (which might happen with some tool-only
+            # responses), fall back to the final state captured from the event
+            # stream — never re-invoke the graph for a second full run.
             if not final_response.strip():
-                try:
-                    result = hr_agent_system.invoke(initial_state)
-                    if result and "messages" in result and result["messages"]:
-                        final_response = result["messages"][-1].content
-                except Exception:
-                    final_response = "Response completed successfully."
+                final_response = final_state_response or "Response completed successfully."
             
-            # Store assistant response in memory
+            # Persist the assistant response in the background so the final
+            # SSE frame is not delayed by the memory write; spawn keeps the
+            # task referenced and logs a failed write.
             if final_response.strip():
-                memory.add_message(sid, "assistant", final_response, {"ts": datetime.now().isoformat()})
+                background.spawn(
+                    asyncio.to_thread(
+                        memory.add_message, sid, "assistant", final_response,
+                        {"ts": request_ts},
+                    ),
+                    name=f"assistant-write:{sid}",
+                )
             
             # Send completion message
             yield f"data: {json.dumps({'type': 'complete', 'final_response': final_response})}\n\n"
@@ -137,6 +168,9 @@ async def chat_stream_endpoint(query: str, session_id: Optional[str] = None):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            # Tell Nginx-style proxies not to buffer the SSE stream, or
+            # tokens arrive in bursts instead of as they are generated.
+            "X-Accel-Buffering": "no",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
         }
@@ -1,6 +1,9 @@
 -- pgvector දිගුව සක්‍රීය කිරීම
 CREATE EXTENSION IF NOT EXISTS vector;
 
+-- ILIKE '%නම%' සෙවීම් සඳහා trigram දිගුව
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- නැවුම් ආරම්භයක් සඳහා පවතින වගු ඉවත් කිරීම
 DROP TABLE IF EXISTS attendances, leave_balances, leave_requests, employees, departments, hr_policies CASCADE;
 
@@ -53,9 +56,29 @@ CREATE TABLE leave_requests (
     employee_id INT REFERENCES employees(id),
     leave_date DATE NOT NULL,
     reason TEXT,
-    status VARCHAR(50) DEFAULT 'pending' -- 'pending', 'approved', 'rejected'
+    status VARCHAR(50) DEFAULT 'pending', -- 'pending', 'approved', 'rejected'
+    CONSTRAINT uq_leave_emp_date UNIQUE (employee_id, leave_date)
 );
 
+-- විශ්ලේෂණ විමසුම් වේගවත් කිරීම සඳහා දර්ශක නිර්මාණය කිරීම
+-- INCLUDE (employee_id) නිසා KPI එකතු කිරීම් index-only scan ලෙස ධාවනය වේ
+CREATE INDEX idx_attendances_date_status ON attendances (attendance_date, status) INCLUDE (employee_id);
+CREATE INDEX idx_attendances_emp_date ON attendances (employee_id, attendance_date);
+CREATE INDEX idx_leave_requests_date_status ON leave_requests (leave_date, status);
+-- සේවකයා අනුව නිවාඩු ඉල්ලීම් ලබා ගැනීම uq_leave_emp_date unique දර්ශකයෙන් ආවරණය වේ
+-- 'Present' වාර්තා පමණක් ගණන් කරන විමසුම් සඳහා partial දර්ශකය
+CREATE INDEX idx_attendances_emp_status_date ON attendances (employee_id, attendance_date)
+    WHERE status = 'Present';
+-- නිවාඩු ශේෂ JOIN එක index scan එකක් වීමට
+CREATE INDEX idx_leave_balance_emp_year ON leave_balances (employee_id, year);
+
+-- නම අනුව ILIKE '%...%' සෙවීම් සඳහා trigram GIN දර්ශකය
+CREATE INDEX idx_employees_name_trgm ON employees USING gin (name gin_trgm_ops);
+
+-- ප්‍රතිපත්ති vector සෙවීම් සඳහා HNSW දර්ශකය (කියවීම්-බහුල corpus එකකට සුදුසුයි)
+CREATE INDEX idx_hr_policies_embedding_hnsw ON hr_policies
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
 -- නියැදි දත්ත ඇතුළත් කිරීම
 
 -- දෙපාර්තමේන්තු දත්ත ඇතුළත් කිරීම
@@ -1178,3 +1201,38 @@ INSERT INTO hr_policies (document_name, chunk_text) VALUES
 ('Work From Home Policy', 'Employees can work from home up to 2 days per week. A formal request must be submitted to the direct manager at least 48 hours in advance. The company provides a monthly allowance for internet connectivity.'),
 ('Leave Policy', 'All permanent employees are entitled to 20 days of annual leave per year. Maternity leave is 84 working days, and paternity leave is 5 working days.'),
 ('Leave Policy', 'Sick leave must be reported to the HR department and the direct manager before 9:00 AM on the day of absence. A medical certificate is required for sick leave of more than 2 consecutive days.');
+
+-- උපකරණ පුවරු විමසුම් සඳහා දිනපතා පැමිණීමේ සාරාංශ materialized view එක
+CREATE MATERIALIZED VIEW mv_attendance_daily_summary AS
+SELECT
+    a.attendance_date,
+    e.department_id,
+    COUNT(*) AS total_count,
+    COUNT(*) FILTER (WHERE a.status = 'Present') AS present_count,
+    COUNT(*) FILTER (WHERE a.status LIKE '%Leave%') AS leave_count,
+    COUNT(*) FILTER (WHERE a.status = 'Absent') AS absent_count
+FROM attendances a
+JOIN employees e ON e.id = a.employee_id
+GROUP BY a.attendance_date, e.department_id;
+
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY සඳහා unique දර්ශකයක් අවශ්‍යයි
+CREATE UNIQUE INDEX idx_mv_attendance_daily_summary
+    ON mv_attendance_daily_summary (attendance_date, department_id);
+
+-- සේවක මට්ටමේ KPI සහ කාර්ය සාධන විමසුම් සඳහා දිනපතා පැමිණීමේ materialized view එක
+CREATE MATERIALIZED VIEW mv_attendance_daily AS
+SELECT
+    employee_id,
+    attendance_date,
+    status,
+    COUNT(*) AS n
+FROM attendances
+GROUP BY employee_id, attendance_date, status;
+
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY සඳහා unique දර්ශකයක් අවශ්‍යයි
+CREATE UNIQUE INDEX idx_mv_attendance_daily
+    ON mv_attendance_daily (employee_id, attendance_date, status);
+
+-- කාල සීමාව අනුව පෙරහන් කරන විමසුම් සඳහා
+CREATE INDEX idx_mv_attendance_daily_date
+    ON mv_attendance_daily (attendance_date);